@@ -5,15 +5,31 @@ import base64
 import json
 import sqlite3
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, Response, render_template, request, jsonify, redirect, session, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, session, url_for, send_from_directory, stream_with_context
 from ultralytics import YOLO
-from werkzeug.utils import secure_filename
 from gemini_spatial import GeminiSpatial
+from detection import CONFIDENCE_THRESHOLD, MODEL_LOCK, extract_detections, draw_detections
+from lanes import CAMERA_LANES, LaneScheduler, parse_lanes
+from auto_capture import capture_best_frame
+from live_detection import MAX_FRAME_BYTES, serve_detection_socket
+from image_ingest import MODEL_IMAGE_SIZE, ARCHIVE_IMAGE_SIZE, read_image, resize_to_fit, scale_detections, encode_archive_jpeg
+from image_upload import read_image_stream, decode_data_url
+from upload_spool import UploadSpool
+from idempotency import IdempotencyCache, IdempotencyConflict, IdempotencyTimeout, IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_WINDOW, MAX_KEY_LENGTH
+from meal_export import EXPORT_FORMATS, export_meals, parse_date_bound
+from thumbnails import ThumbnailWorker, init_meal_thumbnails, get_thumbnail
 from dotenv import load_dotenv
-from recyability import compute_tray_score
+from recyability import compute_tray_score, init_scoring_rules, load_scoring_rules
+from meal_store import connect_meal_db, init_meals, init_meal_items, normalize_items, insert_meal_items, get_meal_items, top_disposed_items
+from server_session import SqliteSessionInterface
+from label_index import LabelIndex, init_label_overrides, load_label_overrides, save_label_override, delete_label_override
+import metrics
+import profiling
+from metrics import timer, timed
 from flask_cors import CORS
+from flask_sock import Sock
 from authlib.integrations.flask_client import OAuth
 from urllib.parse import quote_plus, urlencode
 
@@ -23,16 +39,24 @@ load_dotenv()
 # Set environment variable to skip authorization
 os.environ['OPENCV_AVFOUNDATION_SKIP_AUTH'] = '1'
 
-# Create uploads directory if it doesn't exist
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Uploads are stored under content-hash names in a size- and age-capped spool
+upload_spool = UploadSpool().start()
+UPLOAD_FOLDER = upload_spool.directory
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
 app.secret_key = os.getenv("APP_SECRET_KEY", "your-secret-key")
+# Session data stays on the server; the cookie only carries a session id
+app.session_interface = SqliteSessionInterface()
+
+# Request ids, per-stage timing logs and the /metrics endpoint
+metrics.init_app(app)
+
+# WebSocket routes (live detection for browser cameras)
+app.config['SOCK_SERVER_OPTIONS'] = {'max_message_size': MAX_FRAME_BYTES}
+sock = Sock(app)
 
 # Auth0 setup
 oauth = OAuth(app)
@@ -53,159 +77,101 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
+# Comma-separated emails of the users allowed to use the admin endpoints
+ADMIN_USERS = {email.strip() for email in os.getenv('ADMIN_USERS', '').split(',') if email.strip()}
+
+def is_admin():
+    return session.get('user') in ADMIN_USERS
+
+# Admin required decorator
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if "user" not in session:
+            return redirect("/login")
+        if not is_admin():
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+# Sampled per-request profiling, configured through /admin/profiling
+profiling.init_app(app, is_admin)
+
 # Database setup
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meal_history.db')
+DB_PATH = os.getenv('MEAL_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meal_history.db'))
 
 def init_db():
     """Initialize the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+    conn = connect_meal_db(DB_PATH)
+
     # Create meals table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS meals (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        meal_date TIMESTAMP NOT NULL,
-        meal_image TEXT NOT NULL,
-        meal_items TEXT NOT NULL,
-        tray_score REAL,
-        total_calories INTEGER
-    )
-    ''')
-    conn.commit()
+    init_meals(conn)
+
+    # Create the normalized meal_items table and migrate existing JSON rows
+    init_meal_items(conn)
+
+    # Seed the versioned scoring rules table
+    init_scoring_rules(conn)
+
+    # Admin-curated label categories for the local label index
+    init_label_overrides(conn)
+
+    # Small copies of meal images for the history page
+    init_meal_thumbnails(conn)
     conn.close()
 
 # Initialize the database
 init_db()
 
+# Renders meal history thumbnails off the request path
+thumbnail_worker = ThumbnailWorker(DB_PATH)
+
+# Results of /upload, /analyze_tray (streamed or not) and /auto_capture, replayed to duplicate submissions
+idempotency_cache = IdempotencyCache()
+
+# Categories, food flags and calories of recurring items, learned from past analyses
+label_index = LabelIndex(DB_PATH)
+
 # Load the YOLOv11 model
 model = YOLO('yolo11n.pt')  # Using the nano model for faster inference
 
 # Initialize Gemini Spatial
 gemini = GeminiSpatial()
 
-# COCO dataset class names
-COCO_CLASSES = [
-    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat',
-    'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat',
-    'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack',
-    'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball',
-    'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket',
-    'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
-    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair',
-    'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote',
-    'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book',
-    'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush'
-]
-
-# Whitelist: Only these classes will be shown
-# Modify this list to include only the classes you want to detect
-WHITELIST_CLASSES = [
-    'bottle', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
-    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake',
-    'chair', 'dining table', 'person'
-]
-
-# Confidence threshold for detections (0.0 to 1.0)
-# Lower this value to show more detections with lower confidence
-# Increase this value to only show high-confidence detections
-CONFIDENCE_THRESHOLD = 0.30  # Default is 0.25 (25%)
-
-def generate_frames():
-    # Access webcam (0 is usually the default webcam, 2 is typically the external webcam)
-    cap = cv2.VideoCapture(0)
-    
-    while True:
-        success, frame = cap.read()
-        if not success:
-            break
-        else:
-            # Perform object detection with the confidence threshold
-            results = model(frame, conf=CONFIDENCE_THRESHOLD)
-            
-            # Create a copy of the original frame for drawing filtered results
-            annotated_frame = frame.copy()
-            
-            # Get the detection results
-            boxes = results[0].boxes
-            
-            # Filter and draw only the classes we want
-            detected = False
-            for box in boxes:
-                class_id = int(box.cls.item())
-                class_name = COCO_CLASSES[class_id]
-                
-                # Only include classes in the whitelist
-                if class_name in WHITELIST_CLASSES:
-                    # Get coordinates and confidence
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    confidence = box.conf.item()
-                    
-                    # Draw bounding box
-                    cv2.rectangle(annotated_frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                    
-                    # Add label with class name and confidence
-                    label = f"{class_name}: {confidence:.2f}"
-                    cv2.putText(annotated_frame, label, (int(x1), int(y1) - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                    
-                    detected = True
-            
-            # Convert to jpeg format
-            ret, buffer = cv2.imencode('.jpg', annotated_frame)
-            frame = buffer.tobytes()
-            
-            # Yield the frame in byte format
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+# Camera lanes share the YOLO model through one scheduler thread
+lane_scheduler = LaneScheduler(model, parse_lanes(CAMERA_LANES))
+
+def generate_frames(lane=None):
+    """Annotated MJPEG frames for a camera lane (the first configured lane by default)."""
+    return lane_scheduler.stream(lane or lane_scheduler.default_lane)
 
 def process_image(image_path):
-    # Read the image
-    image = cv2.imread(image_path)
+    # Decode once at the archive size, then downscale to the model's working size
+    with timer('image_decode'):
+        archive_image, _ = read_image(image_path, ARCHIVE_IMAGE_SIZE)
+        if archive_image is None:
+            raise ValueError('Failed to decode image')
+        image, model_scale = resize_to_fit(archive_image, MODEL_IMAGE_SIZE)
     
     # Perform object detection with the confidence threshold
-    results = model(image, conf=CONFIDENCE_THRESHOLD)
-    
-    # Create a copy of the original image for drawing filtered results
-    annotated_image = image.copy()
+    with timer('yolo_inference'), MODEL_LOCK:
+        results = model(image, conf=CONFIDENCE_THRESHOLD)
     
-    # Get the detection results
-    boxes = results[0].boxes
-    
-    # Filter and draw only the classes we want
-    detections = []
-    for box in boxes:
-        class_id = int(box.cls.item())
-        class_name = COCO_CLASSES[class_id]
-        
-        # Only include classes in the whitelist
-        if class_name in WHITELIST_CLASSES:
-            # Get coordinates and confidence
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            confidence = box.conf.item()
-            
-            # Draw bounding box
-            cv2.rectangle(annotated_image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-            
-            # Add label with class name and confidence
-            label = f"{class_name}: {confidence:.2f}"
-            cv2.putText(annotated_image, label, (int(x1), int(y1) - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            
-            # Add detection to the list
-            detections.append({
-                'class': class_name,
-                'confidence': float(confidence),
-                'box': [int(x1), int(y1), int(x2), int(y2)]
-            })
+    # Filter the classes we want and draw them on the archive copy
+    with timer('annotate'):
+        # Boxes are reported in the coordinates of the returned (and stored)
+        # archive image, not of the upload, which the spool eventually evicts
+        detections = scale_detections(extract_detections(results[0]), model_scale)
+        annotated_image = draw_detections(archive_image, detections)
     
     # Convert the annotated image to base64 for displaying in HTML
-    _, buffer = cv2.imencode('.jpg', annotated_image)
-    img_str = base64.b64encode(buffer).decode('utf-8')
+    with timer('jpeg_encode'):
+        buffer = encode_archive_jpeg(annotated_image)
+        img_str = base64.b64encode(buffer).decode('utf-8')
     
     return img_str, detections
 
+@timed('usda_lookup')
 def get_calories_for_food(food_name):
     """
     Get calorie information for a food item using the USDA FoodData Central API.
@@ -213,7 +179,7 @@ def get_calories_for_food(food_name):
     """
     try:
         # Search for the food item
-        search_url = f"https://api.nal.usda.gov/fdc/v1/foods/search"
+        search_url = os.getenv("USDA_API_URL", "https://api.nal.usda.gov/fdc/v1/foods/search")
         params = {
             "api_key": os.getenv("USDA_API_KEY", "DEMO_KEY"),
             "query": food_name,
@@ -255,45 +221,160 @@ def index():
     return render_template('index.html')
 
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(),
+@app.route('/video_feed/<lane>')
+def video_feed(lane=None):
+    if lane is not None and lane not in lane_scheduler.lanes:
+        return jsonify({'error': f"Unknown lane '{lane}'"}), 404
+    return Response(generate_frames(lane),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/lanes')
+def lanes():
+    """Configured camera lanes with their target and achieved detection rates."""
+    return jsonify(lane_scheduler.stats())
+
+@app.before_request
+def require_login_for_sockets():
+    # flask-sock completes the WebSocket handshake before the route runs, so
+    # login_required can't refuse it; unauthenticated upgrades are refused here
+    if request.endpoint == 'detect_socket' and 'user' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+@sock.route('/ws/detect')
+def detect_socket(ws):
+    """Live detection for client-side cameras: frames in, detection JSON out (see live_detection)."""
+    serve_detection_socket(ws, model)
+
+def read_uploaded_image():
+    """
+    Read the image from the current request without holding extra copies of it.
+
+    Returns:
+        The image bytes
+
+    Raises:
+        ValueError: If the request has no image or it is not a supported image
+    """
+    max_bytes = app.config['MAX_CONTENT_LENGTH']
+    if request.mimetype.startswith('image/'):
+        return read_image_stream(request.stream, max_bytes, request.content_length)
+    if request.mimetype == 'multipart/form-data':
+        file = request.files.get('file')
+        if file is None or file.filename == '':
+            raise ValueError('No file part')
+        return read_image_stream(file.stream, max_bytes)
+    return decode_data_url(request.get_data(cache=False))
+
+def upload_hash(file_path):
+    """Content hash of a spooled upload (its file name)."""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def idempotency_key(endpoint, subject):
+    """
+    Key and replay window for an analysis request.
+
+    Requests with an Idempotency-Key header are keyed on it for
+    IDEMPOTENCY_KEY_TTL; others are keyed on what they act on for
+    IDEMPOTENCY_WINDOW, which catches double clicks and retries.
+
+    Args:
+        endpoint: Name the results are stored under
+        subject: What the request acts on: the upload_hash() of its image,
+            or the lane for /auto_capture
+
+    Returns:
+        Tuple of (key, ttl, subject)
+
+    Raises:
+        ValueError: If the Idempotency-Key header is empty or too long
+    """
+    client_key = request.headers.get('Idempotency-Key')
+    if client_key is None:
+        return (session['user'], endpoint, 'subject', subject), IDEMPOTENCY_WINDOW, subject
+    if not client_key or len(client_key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    return (session['user'], endpoint, 'key', client_key), IDEMPOTENCY_KEY_TTL, subject
+
+def run_idempotent(request_key, compute):
+    """
+    Run compute() for an analysis request unless a duplicate already has.
+
+    Args:
+        request_key: What idempotency_key() returned for the request
+        compute: Function returning the response payload
+
+    Returns:
+        JSON response of the result; replays carry an Idempotent-Replayed header
+
+    Raises:
+        IdempotencyConflict: If the Idempotency-Key was used for another image
+        IdempotencyTimeout: If the duplicate's original request took too long
+    """
+    key, ttl, subject = request_key
+    result, replayed = idempotency_cache.run(key, compute, ttl, fingerprint=subject)
+    response = jsonify(result)
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
-    data = request.json  # Expecting JSON payload
-    if 'image' not in data:
-        return jsonify({'error': 'No image provided'}), 400
+    # Accepts a raw image body, a multipart "file" field or the legacy
+    # {"image": "<data URL>"} JSON payload
+    try:
+        image_data = read_uploaded_image()
+        file_path = upload_spool.put(image_data)
+        request_key = idempotency_key('upload', upload_hash(file_path))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    app.logger.debug("Image saved to %s", file_path)
 
     try:
-        # Decode the base64 image
-        image_data = base64.b64decode(data['image'].split(',')[1]) 
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'captured_image.jpg')
-        with open(file_path, 'wb') as f:
-            f.write(image_data)
-        print(f"Image saved to {file_path}")  # Debugging
-
-        # Process the uploaded image
-        img_base64, detections = process_image(file_path)
-
-        # Save the meal to the database
-        conn = sqlite3.connect(DB_PATH)
+        return run_idempotent(request_key, lambda: detect_and_save_meal(file_path))
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except IdempotencyTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in upload: {e}")
+        return jsonify({'error': 'Failed to process image'}), 500
+
+def detect_and_save_meal(file_path):
+    """
+    Run YOLO on an uploaded image and save it as a meal.
+
+    Returns:
+        The /upload response payload
+
+    Raises:
+        ValueError: If the image could not be decoded
+    """
+    # Process the uploaded image
+    img_base64, detections = process_image(file_path)
+
+    # Save the meal to the database; items go to the meal_items table,
+    # the legacy meals.meal_items column is NOT NULL so it gets an empty list
+    with timer('db_write'):
+        conn = connect_meal_db(DB_PATH)
         cursor = conn.cursor()
+        tray_score = compute_tray_score(detections, load_scoring_rules(conn))
         cursor.execute('''
         INSERT INTO meals (user_id, meal_date, meal_image, meal_items, tray_score)
         VALUES (?, ?, ?, ?, ?)
-        ''', (session['user'], datetime.now(), img_base64, json.dumps(detections), compute_tray_score(detections)))
+        ''', (session['user'], datetime.now(), img_base64, '[]', tray_score))
+        meal_id = cursor.lastrowid
+        insert_meal_items(conn, meal_id, normalize_items(detections))
         conn.commit()
         conn.close()
+    thumbnail_worker.submit(meal_id, img_base64)
 
-        return jsonify({
-            'image': f"data:image/jpeg;base64,{img_base64}",
-            'detections': detections
-        })
-    except Exception as e:
-        print(f"Error decoding image: {e}")  # Debugging
-        return jsonify({'error': 'Failed to decode image'}), 400
+    return {
+        'image': f"data:image/jpeg;base64,{img_base64}",
+        'detections': detections
+    }
 
 @app.route('/gemini_detect', methods=['POST'])
 @login_required
@@ -307,9 +388,11 @@ def gemini_detect():
         return jsonify({'error': 'No selected file'}), 400
     
     if file:
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        # Non-images are rejected before anything is saved or sent to Gemini
+        try:
+            file_path = upload_spool.put_stream(file.stream)
+        except ValueError:
+            return jsonify({'error': 'Uploaded file is not a supported image'}), 400
         
         # Process the uploaded image with Gemini
         img_base64, detections = gemini.detect_objects(file_path)
@@ -319,86 +402,265 @@ def gemini_detect():
             'detections': detections
         })
 
-@app.route('/analyze_tray', methods=['POST'])
-@login_required
-def analyze_tray():
+def receive_tray_upload():
+    """
+    Validate and save the tray image from the "file" field of the current request.
+
+    Returns:
+        Path of the saved image
+
+    Raises:
+        ValueError: If the request has no file or it is not a supported image
+    """
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+        raise ValueError('No file part')
     
     file = request.files['file']
     
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        raise ValueError('No selected file')
     
-    if file:
-        # Save the uploaded file
-        file_path = os.path.join('static/uploads', file.filename)
-        os.makedirs('static/uploads', exist_ok=True)
-        file.save(file_path)
+    # Non-images are rejected before anything is saved or sent to Gemini
+    return upload_spool.put_stream(file.stream)
+
+def resolve_tray_item(item):
+    """
+    Give a Gemini tray item the category the label index has for it, before it is drawn or sent.
+
+    Only an exact label match or an admin override replaces Gemini's
+    category; a fuzzy match may be a different item. The replaced category is
+    kept in detected_category, which is what the index learns from.
+    """
+    entry = label_index.lookup(item.get('label', ''))
+    if entry is None or not entry['category'] or entry['category'] == (item.get('category') or '').lower():
+        return
+    if entry['similarity'] == 1.0 or entry['source'] == 'override':
+        item['detected_category'] = item.get('category')
+        item['category'] = entry['category']
+
+def save_tray_analysis(img_base64, categorized_items):
+    """
+    Look up food items and calories for an analyzed tray and save it as a meal.
+
+    The items' categories are expected to be resolved already (gemini
+    analyze_tray with resolve_item=resolve_tray_item), so they match the image.
+
+    Returns:
+        The analysis response payload
+    """
+    # Resolve recurring items with the local label index; only unknown labels go to Gemini
+    with timer('label_index'):
+        food_items = []
+        unknown_items = []
+        for item in categorized_items if isinstance(categorized_items, list) else []:
+            entry = label_index.lookup(item.get('label', '')) if isinstance(item, dict) else None
+            if entry is None:
+                unknown_items.append(item)
+                continue
+            if entry['is_food']:
+                food_items.append(item['label'])
+    
+    # Identify the remaining food items using Gemini
+    if unknown_items:
+        food_items += gemini.identify_food_items(unknown_items)
+    
+    # Get calorie information for each food item, from the index when it has it
+    processed_food_items = []
+    for item in food_items:
+        entry = label_index.lookup(item) if isinstance(item, str) else None
+        if entry and entry['calories'] is not None:
+            calories_info = {
+                'calories': entry['calories'],
+                'serving_size': 100,
+                'serving_unit': 'g',
+                'food_name': item
+            }
+        else:
+            calories_info = get_calories_for_food(item)
+        if calories_info:
+            item_dict = {"name": item, "calories": calories_info}
+        else:
+            item_dict = {"name": item, "calories": None}
+        processed_food_items.append(item_dict)
+    
+    # Calculate total calories
+    total_calories = sum(item["calories"]["calories"] if item["calories"] else 0 for item in processed_food_items)
+    
+    # Save the meal data to the database
+    with timer('db_write'):
+        conn = connect_meal_db(DB_PATH)
+        cursor = conn.cursor()
         
-        try:
-            # Process the image with Gemini
-            img_base64, categorized_items = gemini.analyze_tray(file_path)
-            
-            # Identify food items using Gemini
-            food_items = gemini.identify_food_items(categorized_items)
-            
-            # Get calorie information for each food item
-            processed_food_items = []
-            for item in food_items:
-                calories_info = get_calories_for_food(item)
-                if calories_info:
-                    item_dict = {"name": item, "calories": calories_info}
-                else:
-                    item_dict = {"name": item, "calories": None}
-                processed_food_items.append(item_dict)
-            
-            # Calculate total calories
-            total_calories = sum(item["calories"]["calories"] if item["calories"] else 0 for item in processed_food_items)
-            
-            # Save the meal data to the database
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Create the meals table if it doesn't exist
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS meals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                meal_date TEXT NOT NULL,
-                meal_image TEXT NOT NULL,
-                meal_items TEXT NOT NULL,
-                tray_score REAL,
-                total_calories INTEGER
-            )
-            ''')
-            
-            # Insert the meal data
-            cursor.execute(
-                "INSERT INTO meals (user_id, meal_date, meal_image, meal_items, tray_score, total_calories) VALUES (?, ?, ?, ?, ?, ?)",
-                (
-                    session['user'],
-                    datetime.now().isoformat(),
-                    img_base64,
-                    json.dumps(processed_food_items),
-                    None,  # Tray score (to be implemented later)
-                    total_calories
-                )
+        # Create the meals table if it doesn't exist
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            meal_date TEXT NOT NULL,
+            meal_image TEXT NOT NULL,
+            meal_items TEXT NOT NULL,
+            tray_score REAL,
+            total_calories INTEGER
+        )
+        ''')
+        
+        # Insert the meal data
+        cursor.execute(
+            "INSERT INTO meals (user_id, meal_date, meal_image, meal_items, tray_score, total_calories) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                session['user'],
+                datetime.now().isoformat(),
+                img_base64,
+                '[]',  # Items are stored in meal_items
+                None,  # Tray score (to be implemented later)
+                total_calories
             )
-            
-            conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'image': f"data:image/jpeg;base64,{img_base64}",
-                'categorized_items': categorized_items,
-                'food_items': processed_food_items,
-                'total_calories': total_calories
-            })
-            
+        )
+        meal_id = cursor.lastrowid
+        rows = normalize_items(categorized_items, processed_food_items)
+        insert_meal_items(conn, meal_id, rows)
+        
+        conn.commit()
+        conn.close()
+    thumbnail_worker.submit(meal_id, img_base64)
+    label_index.observe(rows)
+    
+    return {
+        'image': f"data:image/jpeg;base64,{img_base64}",
+        'categorized_items': categorized_items,
+        'food_items': processed_food_items,
+        'total_calories': total_calories
+    }
+
+@app.route('/analyze_tray', methods=['POST'])
+@login_required
+def analyze_tray():
+    try:
+        file_path = receive_tray_upload()
+        request_key = idempotency_key('analyze_tray', upload_hash(file_path))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def analyze():
+        # Process the image with Gemini
+        img_base64, categorized_items = gemini.analyze_tray(file_path, resolve_item=resolve_tray_item)
+        return save_tray_analysis(img_base64, categorized_items)
+    
+    try:
+        return run_idempotent(request_key, analyze)
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except IdempotencyTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        print(f"Error in analyze_tray: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/auto_capture', methods=['POST'])
+@app.route('/auto_capture/<lane>', methods=['POST'])
+@login_required
+def auto_capture(lane=None):
+    """
+    Pick the best frame from a camera lane and analyze it like /analyze_tray.
+
+    The lane is watched until the tray has been steady for a few frames (or
+    AUTO_CAPTURE_TIMEOUT seconds), and only the sharpest, steadiest frame is
+    sent to Gemini. The response adds a "capture" summary of that frame's scores.
+    Every capture is a different image, so duplicates are keyed on the lane.
+    """
+    lane = lane or lane_scheduler.default_lane
+    if lane not in lane_scheduler.lanes:
+        return jsonify({'error': f"Unknown lane '{lane}'"}), 404
+    try:
+        request_key = idempotency_key('auto_capture', lane)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def capture_and_analyze():
+        with timer('auto_capture'):
+            frame, _, capture = capture_best_frame(lane_scheduler, lane)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        file_path = upload_spool.put(buffer.tobytes())
+        img_base64, categorized_items = gemini.analyze_tray(file_path, resolve_item=resolve_tray_item)
+        return dict(save_tray_analysis(img_base64, categorized_items), capture=capture)
+
+    try:
+        return run_idempotent(request_key, capture_and_analyze)
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except IdempotencyTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except TimeoutError as e:
+        # The lane produced no frames
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        print(f"Error in auto_capture: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def sse_event(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/analyze_tray/stream', methods=['POST'])
+@login_required
+def analyze_tray_stream():
+    """
+    Like /analyze_tray, but streams the result as server-sent events:
+    an "item" event for each detection as soon as Gemini has produced it,
+    then a "result" event with the same payload /analyze_tray returns
+    (or an "error" event).
+
+    Duplicates share /analyze_tray's idempotency keys: they wait for the
+    original request and then get its stored items as "item" events
+    followed by one "result" event.
+    """
+    try:
+        file_path = receive_tray_upload()
+        key, ttl, subject = idempotency_key('analyze_tray', upload_hash(file_path))
+        claim = idempotency_cache.claim(key, ttl, fingerprint=subject)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    
+    def replay():
+        result = claim.wait()
+        for item in result['categorized_items'] if isinstance(result['categorized_items'], list) else []:
+            yield sse_event('item', item)
+        yield sse_event('result', result)
+    
+    def analyze():
+        for event, data in gemini.analyze_tray_stream(file_path, resolve_item=resolve_tray_item):
+            if event == 'item':
+                yield sse_event('item', data)
+            elif event == 'error':
+                claim.fail(RuntimeError(data))
+                yield sse_event('error', {'error': data})
+                return
+            else:
+                img_base64, categorized_items = data
+                result = save_tray_analysis(img_base64, categorized_items)
+                claim.complete(result)
+                yield sse_event('result', result)
+    
+    def generate():
+        try:
+            yield from (analyze() if claim.owner else replay())
         except Exception as e:
-            print(f"Error in analyze_tray: {e}")
-            return jsonify({'error': str(e)}), 500
+            print(f"Error in analyze_tray_stream: {e}")
+            claim.fail(e)
+            yield sse_event('error', {'error': str(e)})
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    if not claim.owner:
+        response.headers['Idempotent-Replayed'] = 'true'
+    # Duplicates must not wait on a stream that was closed before it finished
+    response.call_on_close(claim.release)
+    return response
 
 @app.route('/login')
 def login():
@@ -418,7 +680,9 @@ def callback():
             resp = oauth.auth0.get(userinfo_url, token=token)
             userinfo = resp.json()
         
-        # Store user info in session
+        # Store user info in session, under a new session id so an id set
+        # before login can't be reused
+        session.regenerate()
         session['user'] = userinfo.get('email', userinfo.get('sub'))
         session['user_info'] = userinfo
         
@@ -432,33 +696,199 @@ def logout():
     session.clear()
     return redirect('/')
 
+# Test-only session injection for the load-testing harness; never enable
+# LOAD_TEST_MODE outside a local test instance
+if os.getenv('LOAD_TEST_MODE') == '1':
+    print("WARNING: LOAD_TEST_MODE is enabled, /load_test/login bypasses Auth0 for local clients")
+
+    @app.route('/load_test/login', methods=['POST'])
+    def load_test_login():
+        if request.remote_addr not in ('127.0.0.1', '::1'):
+            return jsonify({'error': 'Load-test login is only available locally'}), 403
+        session['user'] = request.args.get('user', 'loadtest@example.com')
+        return jsonify({'user': session['user']})
+
 @app.route('/meal_history')
 @login_required
 def meal_history():
     try:
         # Get meal history for the logged-in user
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row  # This enables column access by name
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT * FROM meals WHERE user_id = ? ORDER BY meal_date DESC",
-            (session['user'],)
-        )
-        
-        meals = []
-        for row in cursor.fetchall():
-            meal = dict(row)
-            # Parse the JSON string of meal items
-            meal['meal_items'] = json.loads(meal['meal_items'])
-            meals.append(meal)
+        with timer('db_read'):
+            conn = connect_meal_db(DB_PATH)
+            conn.row_factory = sqlite3.Row  # This enables column access by name
+            cursor = conn.cursor()
             
-        conn.close()
+            # The full image is only read for meals whose thumbnail isn't ready yet
+            cursor.execute('''
+            SELECT m.id, m.user_id, m.meal_date, m.tray_score, m.total_calories,
+                   t.meal_id IS NOT NULL AS has_thumbnail,
+                   CASE WHEN t.meal_id IS NULL THEN m.meal_image END AS meal_image
+            FROM meals m
+            LEFT JOIN meal_thumbnails t ON t.meal_id = m.id
+            WHERE m.user_id = ?
+            ORDER BY m.meal_date DESC
+            ''', (session['user'],))
+            
+            meals = [dict(row) for row in cursor.fetchall()]
+            
+            # Attach the normalized items for all meals in one query
+            items_by_meal = get_meal_items(conn, [meal['id'] for meal in meals])
+            for meal in meals:
+                meal['meal_items'] = items_by_meal[meal['id']]
+            
+            conn.close()
         
         return render_template('meal_history.html', meals=meals, user=session.get('user'))
     except Exception as e:
         print(f"Error retrieving meal history: {e}")
         return render_template('meal_history.html', meals=[], user=session.get('user'), error="Could not retrieve meal history")
 
+@app.route('/meal_history/<int:meal_id>/thumbnail')
+@login_required
+def meal_thumbnail(meal_id):
+    with timer('db_read'):
+        conn = connect_meal_db(DB_PATH)
+        thumbnail = get_thumbnail(conn, meal_id, session['user'])
+        conn.close()
+    if thumbnail is None:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+
+    # A meal's thumbnail never changes, so browsers can keep it indefinitely
+    image, mime_type = thumbnail
+    return Response(image, mimetype=mime_type, headers={
+        'Cache-Control': 'private, max-age=31536000, immutable'
+    })
+
+@app.route('/top_items')
+@login_required
+def top_items():
+    """Most frequently scanned items for the logged-in user over the last N days."""
+    days = request.args.get('days', 7, type=int)
+    category = request.args.get('category')
+    limit = request.args.get('limit', 10, type=int)
+
+    conn = connect_meal_db(DB_PATH)
+    items = top_disposed_items(
+        conn,
+        datetime.now() - timedelta(days=days),
+        user_id=session['user'],
+        category=category,
+        limit=limit
+    )
+    conn.close()
+
+    return jsonify({'days': days, 'category': category, 'items': items})
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+@admin_required
+def profiling_settings():
+    """Show or change the request profiling settings (sample_rate, mode, trace_memory, interval)."""
+    if request.method == 'GET':
+        return jsonify(profiling.settings)
+
+    changes = request.get_json(silent=True) or {}
+    allowed = {'sample_rate', 'mode', 'trace_memory', 'interval'}
+    try:
+        return jsonify(profiling.update_settings(**{k: v for k, v in changes.items() if k in allowed}))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/admin/profiles')
+@admin_required
+def list_profiles():
+    return jsonify({'profiles': profiling.list_profiles(request.args.get('limit', 100, type=int))})
+
+@app.route('/admin/profiles/<path:filename>')
+@admin_required
+def download_profile(filename):
+    return send_from_directory(profiling.PROFILE_DIR, filename, as_attachment=True)
+
+@app.route('/admin/label_overrides', methods=['GET', 'POST'])
+@admin_required
+def label_overrides():
+    """
+    List the label overrides, or add/replace one with a JSON body of
+    {label, category, is_food, calories}.
+    """
+    conn = connect_meal_db(DB_PATH)
+    try:
+        if request.method == 'GET':
+            return jsonify({'overrides': load_label_overrides(conn), 'index': label_index.stats()})
+
+        data = request.get_json(silent=True) or {}
+        try:
+            calories = data.get('calories')
+            label = save_label_override(
+                conn,
+                data.get('label', ''),
+                category=data.get('category'),
+                is_food=data.get('is_food', False),
+                calories=float(calories) if calories is not None else None,
+                updated_by=session['user']
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+
+    label_index.refresh()
+    return jsonify(label_index.lookup(label))
+
+@app.route('/admin/label_overrides/<path:label>', methods=['DELETE'])
+@admin_required
+def delete_label_override_route(label):
+    conn = connect_meal_db(DB_PATH)
+    try:
+        deleted = delete_label_override(conn, label)
+    finally:
+        conn.close()
+    if not deleted:
+        return jsonify({'error': 'No override for this label'}), 404
+
+    label_index.refresh()
+    return jsonify({'deleted': label})
+
+@app.route('/admin/label_index')
+@admin_required
+def lookup_label():
+    """Show how the local label index resolves ?label=..."""
+    return jsonify({
+        'label': request.args.get('label', ''),
+        'match': label_index.lookup(request.args.get('label', '')),
+        'index': label_index.stats()
+    })
+
+@app.route('/admin/export/meals')
+@admin_required
+def export_meal_history():
+    """
+    Stream meal history for a date range as NDJSON (default) or CSV.
+
+    Query parameters: format=ndjson|csv, start and end (YYYY-MM-DD, end
+    inclusive, or ISO datetimes), user, gzip=1.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        start = parse_date_bound(request.args.get('start'))
+        end = parse_date_bound(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO dates (YYYY-MM-DD)'}), 400
+    compress = request.args.get('gzip') == '1'
+
+    filename = f"meals.{fmt}" + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(export_meals(DB_PATH, fmt, start, end, request.args.get('user'), compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/admin/spool')
+@admin_required
+def spool_stats():
+    """Usage of the upload spool."""
+    return jsonify(upload_spool.stats())
+
 if __name__ == '__main__':
     app.run(debug=True)
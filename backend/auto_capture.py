@@ -0,0 +1,171 @@
+import os
+import queue
+import time
+
+import cv2
+
+from image_ingest import resize_to_fit
+
+# Longest seconds to watch a lane before settling for the best frame so far
+AUTO_CAPTURE_TIMEOUT = float(os.getenv('AUTO_CAPTURE_TIMEOUT', 5.0))
+
+# Consecutive steady frames (little motion, same detections) that end the
+# capture early once the tray has settled
+STABLE_FRAMES = int(os.getenv('AUTO_CAPTURE_STABLE_FRAMES', 5))
+
+# Mean absolute grey-level change (0-1) between frames below which a frame
+# counts as still, and the detection stability (0-1) above which the
+# detections count as steady
+MOTION_THRESHOLD = 0.02
+STABILITY_THRESHOLD = 0.7
+
+# Frames are scored on a small grey copy; the metrics only need to rank frames
+SCORING_IMAGE_SIZE = 320
+
+# Smallest IoU for two same-class detections in consecutive frames to count
+# as the same object
+MATCH_IOU = 0.5
+
+
+def iou(a, b):
+    """Intersection over union of two [x1, y1, x2, y2] boxes."""
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def detection_stability(previous, current):
+    """
+    How much two consecutive frames' detections agree, from 0 to 1.
+
+    Detections are matched greedily by class and IoU; the score is the summed
+    IoU of the matches over the larger of the two detection counts, so
+    objects appearing, vanishing or moving all lower it. Two frames without
+    detections agree completely.
+    """
+    if not previous and not current:
+        return 1.0
+    unmatched = list(previous)
+    total = 0.0
+    for detection in current:
+        best, best_iou = None, MATCH_IOU
+        for candidate in unmatched:
+            if candidate['class'] == detection['class']:
+                overlap = iou(candidate['box'], detection['box'])
+                if overlap >= best_iou:
+                    best, best_iou = candidate, overlap
+        if best is not None:
+            unmatched.remove(best)
+            total += best_iou
+    return total / max(len(previous), len(current))
+
+
+class BestFrameSelector:
+    """
+    Scores a stream of frames and keeps the best one.
+
+    Each frame gets a sharpness (variance of the Laplacian), its motion
+    relative to the previous frame and the stability of its detections
+    relative to the previous frame's. A frame's score is its sharpness
+    discounted by motion and detection instability, so a blurred frame, a
+    frame taken while the tray is moving or one with a hand passing through
+    all lose to a steady, sharp view. Only the best frame so far is kept.
+    """
+
+    def __init__(self, stable_frames=STABLE_FRAMES):
+        self.stable_frames = stable_frames
+        self.frames_scored = 0
+        self.stable_run = 0
+        self.best_frame = None
+        self.best_detections = None
+        self.best_metrics = None
+        self._previous_gray = None
+        self._previous_detections = None
+
+    @property
+    def settled(self):
+        """Whether the last stable_frames frames were all steady."""
+        return self.stable_run >= self.stable_frames
+
+    def add(self, frame, detections):
+        """Score one frame. Returns its metrics."""
+        small, _ = resize_to_fit(frame, SCORING_IMAGE_SIZE)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+
+        if self._previous_gray is None or self._previous_gray.shape != gray.shape:
+            # Nothing to compare the first frame with; it can't count as steady yet
+            motion, stability = 1.0, 0.0
+        else:
+            motion = cv2.absdiff(gray, self._previous_gray).mean() / 255
+            stability = detection_stability(self._previous_detections, detections)
+        self._previous_gray = gray
+        self._previous_detections = detections
+
+        steady = motion < MOTION_THRESHOLD and stability >= STABILITY_THRESHOLD
+        self.stable_run = self.stable_run + 1 if steady else 0
+        score = sharpness * max(0.0, 1.0 - motion / MOTION_THRESHOLD / 4) * (0.5 + 0.5 * stability)
+
+        metrics = {
+            'sharpness': round(float(sharpness), 2),
+            'motion': round(float(motion), 4),
+            'stability': round(stability, 3),
+            'score': round(float(score), 2),
+        }
+        self.frames_scored += 1
+        if self.best_metrics is None or score > self.best_metrics['score']:
+            self.best_frame = frame
+            self.best_detections = detections
+            self.best_metrics = metrics
+        return metrics
+
+
+def capture_best_frame(scheduler, lane_name, timeout=AUTO_CAPTURE_TIMEOUT, stable_frames=STABLE_FRAMES):
+    """
+    Watch a camera lane and return its best frame for analysis.
+
+    Frames are scored as the lane scheduler detects them, until the view has
+    been steady for stable_frames frames or timeout seconds have passed.
+
+    Returns:
+        Tuple of (BGR frame, its YOLO detections, summary dict with the
+        frame's metrics, frames scored, whether the view settled and seconds taken)
+
+    Raises:
+        KeyError: If the lane is not configured
+        TimeoutError: If the lane produced no frames within timeout
+    """
+    frames = queue.Queue(maxsize=2)
+
+    def on_frame(frame, detections):
+        # Scoring happens on this thread, not the scheduler's; if it falls
+        # behind, frames are skipped rather than queued
+        try:
+            frames.put_nowait((frame, detections))
+        except queue.Full:
+            pass
+
+    selector = BestFrameSelector(stable_frames)
+    start = time.monotonic()
+    with scheduler.observe(lane_name, on_frame):
+        while not selector.settled:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            try:
+                frame, detections = frames.get(timeout=remaining)
+            except queue.Empty:
+                break
+            selector.add(frame, detections)
+
+    if selector.best_frame is None:
+        raise TimeoutError(f"Lane '{lane_name}' produced no frames within {timeout:g}s")
+    return selector.best_frame, selector.best_detections, {
+        'lane': lane_name,
+        'frames_scored': selector.frames_scored,
+        'settled': selector.settled,
+        'seconds': round(time.monotonic() - start, 2),
+        **selector.best_metrics,
+    }
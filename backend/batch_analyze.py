@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from ultralytics import YOLO
+
+from detection import CONFIDENCE_THRESHOLD, extract_detections
+from gemini_spatial import GeminiSpatial
+from image_ingest import MODEL_IMAGE_SIZE, read_image, scale_detections
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def find_images(root):
+    """Return all image paths under root, sorted so runs are reproducible."""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+
+def load_checkpoint(output_path):
+    """
+    Read an existing JSONL output and return the paths that completed without errors.
+
+    Images whose last record has an error are retried on the next run.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if record.get('error'):
+                done.discard(record['path'])
+            else:
+                done.add(record['path'])
+    return done
+
+
+def _analyze_with_gemini(gemini, path):
+    _, items = gemini.analyze_tray(path, annotate=False)
+    if isinstance(items, dict) and 'error' in items:
+        raise RuntimeError(items['error'])
+    return items
+
+
+def run_batch(paths, output_path, model=None, gemini=None, batch_size=16, concurrency=4):
+    """
+    Analyse images in batches and append one JSONL record per image to output_path.
+
+    YOLO runs batched inference on the calling thread while Gemini requests for
+    the same batch run on a pool of at most `concurrency` threads. The output
+    file is flushed after every batch so it doubles as the resume checkpoint.
+
+    Args:
+        paths: Image paths to analyse
+        output_path: JSONL file to append results to
+        model: YOLO model, or None to skip YOLO
+        gemini: GeminiSpatial instance, or None to skip Gemini
+        batch_size: Number of images per YOLO batch
+        concurrency: Maximum number of concurrent Gemini requests
+
+    Returns:
+        Dict of throughput statistics
+    """
+    stats = {'images': 0, 'errors': 0, 'yolo_seconds': 0.0, 'gemini_wait_seconds': 0.0}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, open(output_path, 'a') as out:
+        for batch_start in range(0, len(paths), batch_size):
+            batch = paths[batch_start:batch_start + batch_size]
+            records = {path: {'path': path, 'yolo': None, 'gemini': None, 'error': None} for path in batch}
+
+            # Start the Gemini calls first so they overlap with YOLO inference
+            futures = {}
+            if gemini is not None:
+                futures = {path: pool.submit(_analyze_with_gemini, gemini, path) for path in batch}
+
+            if model is not None:
+                yolo_start = time.perf_counter()
+                images = []
+                for path in batch:
+                    image, scale = read_image(path, MODEL_IMAGE_SIZE)
+                    if image is None:
+                        records[path]['error'] = 'Could not read image'
+                    else:
+                        images.append((path, image, scale))
+                if images:
+                    results = model([image for _, image, _ in images], conf=CONFIDENCE_THRESHOLD, verbose=False)
+                    for (path, _, scale), result in zip(images, results):
+                        records[path]['yolo'] = scale_detections(extract_detections(result), scale)
+                stats['yolo_seconds'] += time.perf_counter() - yolo_start
+
+            wait_start = time.perf_counter()
+            for path, future in futures.items():
+                try:
+                    records[path]['gemini'] = future.result()
+                except Exception as e:
+                    records[path]['error'] = f"Gemini: {e}"
+            stats['gemini_wait_seconds'] += time.perf_counter() - wait_start
+
+            for path in batch:
+                record = records[path]
+                record['processed_at'] = datetime.now().isoformat()
+                if record['error']:
+                    stats['errors'] += 1
+                out.write(json.dumps(record) + '\n')
+            out.flush()
+
+            stats['images'] += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"[{stats['images']}/{len(paths)}] {stats['images'] / elapsed:.2f} images/s")
+
+    stats['elapsed_seconds'] = time.perf_counter() - start
+    stats['images_per_second'] = stats['images'] / stats['elapsed_seconds'] if stats['elapsed_seconds'] else 0.0
+    return stats
+
+
+def write_parquet(jsonl_path, parquet_path):
+    """Convert the JSONL results to Parquet, keeping the latest record per image."""
+    try:
+        import pandas as pd
+    except ImportError:
+        print("pandas is required for Parquet output; results are available as JSONL")
+        return False
+
+    records = {}
+    with open(jsonl_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record['path']] = record
+
+    # Nested detections are stored as JSON strings to keep the schema flat
+    df = pd.DataFrame([
+        {
+            'path': record['path'],
+            'yolo': json.dumps(record['yolo']),
+            'gemini': json.dumps(record['gemini']),
+            'error': record['error'],
+            'processed_at': record['processed_at'],
+        }
+        for record in records.values()
+    ])
+    try:
+        df.to_parquet(parquet_path, index=False)
+    except ImportError as e:
+        print(f"Could not write Parquet ({e}); results are available as JSONL")
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Analyse a directory of tray images offline")
+    parser.add_argument('directory', help="Directory of images, e.g. backend/pictures")
+    parser.add_argument('--output', default='tray_results.jsonl', help="JSONL output file (also the checkpoint)")
+    parser.add_argument('--parquet', help="Also write the results to this Parquet file when done")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=4, help="Maximum concurrent Gemini requests")
+    parser.add_argument('--model', default='yolo11n.pt', help="YOLO weights")
+    parser.add_argument('--no-yolo', action='store_true')
+    parser.add_argument('--no-gemini', action='store_true')
+    parser.add_argument('--no-resume', action='store_true', help="Re-process images already in the output file")
+    args = parser.parse_args()
+
+    paths = find_images(args.directory)
+    if not args.no_resume:
+        done = load_checkpoint(args.output)
+        skipped = len(paths)
+        paths = [path for path in paths if path not in done]
+        skipped -= len(paths)
+        if skipped:
+            print(f"Resuming: skipping {skipped} already processed images")
+
+    stats = run_batch(
+        paths,
+        args.output,
+        model=None if args.no_yolo else YOLO(args.model),
+        gemini=None if args.no_gemini else GeminiSpatial(),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency
+    )
+    print(
+        f"Processed {stats['images']} images ({stats['errors']} errors) in {stats['elapsed_seconds']:.1f}s: "
+        f"{stats['images_per_second']:.2f} images/s, "
+        f"YOLO {stats['yolo_seconds']:.1f}s, waiting on Gemini {stats['gemini_wait_seconds']:.1f}s"
+    )
+
+    if args.parquet:
+        write_parquet(args.output, args.parquet)
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices
+from run_benchmarks import percentile
+
+# Labels match when this fraction of their words are shared
+LABEL_MATCH_THRESHOLD = 0.5
+
+
+def normalize_label(label):
+    return set(re.findall(r'[a-z0-9]+', str(label).lower()))
+
+
+def label_similarity(a, b):
+    words_a, words_b = normalize_label(a), normalize_label(b)
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def compare_items(predicted, expected):
+    """
+    Match predicted items to expected ones by label.
+
+    Returns:
+        Tuple of (matched pairs, predicted count, expected count)
+    """
+    remaining = [item for item in expected if isinstance(item, dict)]
+    pairs = []
+    for item in predicted:
+        if not isinstance(item, dict) or not remaining:
+            continue
+        best = max(remaining, key=lambda candidate: label_similarity(item.get('label'), candidate.get('label')))
+        if label_similarity(item.get('label'), best.get('label')) >= LABEL_MATCH_THRESHOLD:
+            pairs.append((item, best))
+            remaining.remove(best)
+    return pairs, len(predicted), len(expected)
+
+
+def agreement(results, reference):
+    """Label F1 and category agreement of results against reference, summed over images."""
+    matched = predicted = expected = same_category = 0
+    for path, items in results.items():
+        if path not in reference:
+            continue
+        pairs, n_predicted, n_expected = compare_items(items, reference[path])
+        matched += len(pairs)
+        predicted += n_predicted
+        expected += n_expected
+        same_category += sum(
+            1 for item, truth in pairs
+            if str(item.get('category', '')).lower() == str(truth.get('category', '')).lower()
+        )
+
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'label_f1': round(f1, 3),
+        'category_agreement': round(same_category / matched, 3) if matched else 0.0,
+    }
+
+
+def evaluate_policy(name, paths, repeat):
+    """Run every image through Gemini with one policy. Returns (summary, items per image)."""
+    from gemini_spatial import GeminiSpatial, TRAY_ANALYSIS_PROMPT
+    from image_policy import load_image_policy, uncrop_items
+
+    gemini = GeminiSpatial(image_policy=load_image_policy(name))
+    latencies, prompt_tokens, output_tokens, image_bytes = [], [], [], []
+    results = {}
+    for path in paths:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _, img_bytes, region = gemini._prepare_image(path)
+            response = gemini._generate_content(TRAY_ANALYSIS_PROMPT, img_bytes)
+            items = uncrop_items(json.loads(gemini._parse_json(response.text)), region)
+            latencies.append(time.perf_counter() - start)
+
+            image_bytes.append(len(img_bytes))
+            usage = response.usage_metadata
+            prompt_tokens.append(usage.prompt_token_count)
+            output_tokens.append(usage.candidates_token_count)
+        results[os.path.basename(path)] = items
+
+    summary = {
+        'policy': gemini.image_policy,
+        'images': len(paths),
+        'mean_prompt_tokens': round(sum(prompt_tokens) / len(prompt_tokens), 1),
+        'mean_output_tokens': round(sum(output_tokens) / len(output_tokens), 1),
+        'mean_image_kb': round(sum(image_bytes) / len(image_bytes) / 1024, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+    return summary, results
+
+
+def main():
+    from image_policy import IMAGE_POLICIES
+
+    parser = argparse.ArgumentParser(
+        description="Compare Gemini image preparation policies by token usage, latency and label agreement"
+    )
+    parser.add_argument('directory', nargs='?', default=os.path.join(BACKEND_DIR, 'pictures'),
+                        help="Directory of tray images")
+    parser.add_argument('--labels', help="JSON file mapping image file names to their expected items "
+                                         "([{\"label\": ..., \"category\": ...}]); by default the first "
+                                         "policy's results are the reference")
+    parser.add_argument('--policies', default=','.join(IMAGE_POLICIES),
+                        help=f"Comma-separated policies to compare (default {','.join(IMAGE_POLICIES)})")
+    parser.add_argument('--repeat', type=int, default=1, help="Calls per image and policy")
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help="Largest drop in label F1 accepted when picking the cheapest policy")
+    parser.add_argument('--offline', action='store_true',
+                        help="Use the fake Gemini server instead of the real API (tokens are estimated)")
+    parser.add_argument('--gemini-latency', type=float, default=0.0, help="Seconds per fake Gemini response")
+    parser.add_argument('--output', help="Write the comparison as JSON to this file")
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.directory, name) for name in os.listdir(args.directory)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    policies = args.policies.split(',')
+    for name in policies:
+        if name not in IMAGE_POLICIES:
+            parser.error(f"unknown policy '{name}'")
+
+    services = None
+    if args.offline:
+        # Must be set before gemini_spatial is imported
+        services = FakeServices(args.gemini_latency).start()
+        os.environ['GEMINI_API_ENDPOINT'] = services.url
+        os.environ.setdefault('GEMINI_API_KEY', 'evaluation')
+
+    try:
+        runs = [(name, *evaluate_policy(name, paths, args.repeat)) for name in policies]
+    finally:
+        if services:
+            services.stop()
+
+    if args.labels:
+        with open(args.labels) as f:
+            reference, reference_name = json.load(f), os.path.basename(args.labels)
+    else:
+        reference, reference_name = runs[0][2], policies[0]
+
+    print(f"Label agreement against {reference_name}")
+    print(f"{'policy':<16} {'prompt tok':>10} {'output tok':>10} {'image KB':>9} {'p50 ms':>9} {'label F1':>9} {'category':>9}")
+    summaries = []
+    for name, summary, results in runs:
+        summary.update(agreement(results, reference))
+        summaries.append(summary)
+        print(
+            f"{name:<16} {summary['mean_prompt_tokens']:>10.1f} {summary['mean_output_tokens']:>10.1f} "
+            f"{summary['mean_image_kb']:>9.1f} {summary['p50_ms']:>9.1f} "
+            f"{summary['label_f1']:>9.3f} {summary['category_agreement']:>9.3f}"
+        )
+
+    # The cheapest policy whose labels are nearly as good as the best one's
+    best_f1 = max(summary['label_f1'] for summary in summaries)
+    acceptable = [summary for summary in summaries if summary['label_f1'] >= best_f1 - args.tolerance]
+    cheapest = min(acceptable, key=lambda summary: (summary['mean_prompt_tokens'], summary['p50_ms']))
+    print(f"Cheapest policy within {args.tolerance:.2f} F1 of the best: {cheapest['policy']['name']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'reference': reference_name,
+                'policies': summaries,
+                'recommended': cheapest['policy']['name'],
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import base64
+import io
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_policy import estimate_image_tokens
+
+RESPONSES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'responses')
+
+# Which recorded Gemini response to replay, chosen by a phrase in the prompt
+GEMINI_RESPONSE_RULES = [
+    ('identify which ones are food', 'gemini_identify_food.json'),
+]
+GEMINI_DEFAULT_RESPONSE = 'gemini_analyze_tray.json'
+USDA_RESPONSE = 'usda_search.json'
+
+# Streamed Gemini responses are split into this many chunks, spread over the latency
+GEMINI_STREAM_CHUNKS = 8
+
+
+def load_response(filename):
+    with open(os.path.join(RESPONSES_DIR, filename), 'rb') as f:
+        return f.read()
+
+
+def estimate_usage(request_body, response_text):
+    """
+    Estimate Gemini usageMetadata for a generateContent request body.
+
+    Text is counted at ~4 characters per token and images with Gemini's
+    tiling rule, so image policies can be compared offline.
+    """
+    try:
+        request = json.loads(request_body)
+    except ValueError:
+        request = {}
+
+    parts = list(request.get('systemInstruction', {}).get('parts', []))
+    for content in request.get('contents', []):
+        parts.extend(content.get('parts', []))
+
+    prompt_tokens = 0
+    for part in parts:
+        if 'text' in part:
+            prompt_tokens += len(part['text']) // 4
+        inline_data = part.get('inlineData') or part.get('inline_data')
+        if inline_data:
+            with Image.open(io.BytesIO(base64.b64decode(inline_data['data']))) as img:
+                prompt_tokens += estimate_image_tokens(*img.size)
+
+    candidates_tokens = len(response_text) // 4
+    return {
+        'promptTokenCount': prompt_tokens,
+        'candidatesTokenCount': candidates_tokens,
+        'totalTokenCount': prompt_tokens + candidates_tokens,
+    }
+
+
+class FakeServices:
+    """
+    A local HTTP server standing in for the Gemini REST API and USDA FoodData Central.
+
+    Replays the recorded responses in benchmarks/responses after a configurable
+    delay, so benchmarks run offline with realistic external latency. Streaming
+    Gemini calls receive the same response in chunks spread over that delay.
+    Gemini usageMetadata is estimated from each request (see estimate_usage).
+
+    Usage:
+        with FakeServices(gemini_latency=0.8, usda_latency=0.1) as services:
+            os.environ['GEMINI_API_ENDPOINT'] = services.url
+            os.environ['USDA_API_URL'] = services.usda_url
+    """
+
+    def __init__(self, gemini_latency=0.0, usda_latency=0.0, host='127.0.0.1', port=0):
+        self.gemini_latency = gemini_latency
+        self.usda_latency = usda_latency
+        self.request_counts = {'gemini': 0, 'usda': 0}
+        self._lock = threading.Lock()
+        self._responses = {
+            filename: load_response(filename)
+            for filename in {GEMINI_DEFAULT_RESPONSE, USDA_RESPONSE, *(f for _, f in GEMINI_RESPONSE_RULES)}
+        }
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def usda_url(self):
+        return f"{self.url}/fdc/v1/foods/search"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, service):
+        with self._lock:
+            self.request_counts[service] += 1
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                stream = ':streamGenerateContent' in self.path
+                if ':generateContent' not in self.path and not stream:
+                    self._send(404, b'{"error": "not found"}')
+                    return
+
+                services._count('gemini')
+                prompt = body.decode('utf-8', errors='ignore')
+                filename = GEMINI_DEFAULT_RESPONSE
+                for phrase, rule_filename in GEMINI_RESPONSE_RULES:
+                    if phrase in prompt:
+                        filename = rule_filename
+                        break
+                response = json.loads(services._responses[filename])
+                text = response['candidates'][0]['content']['parts'][0]['text']
+                response['usageMetadata'] = estimate_usage(body, text)
+                if stream:
+                    self._send_stream(response)
+                    return
+                time.sleep(services.gemini_latency)
+                self._send(200, json.dumps(response).encode())
+
+            def do_GET(self):
+                if not self.path.startswith('/fdc/v1/foods/search'):
+                    self._send(404, b'{"error": "not found"}')
+                    return
+
+                services._count('usda')
+                time.sleep(services.usda_latency)
+                self._send(200, services._responses[USDA_RESPONSE])
+
+            def _send(self, status, payload):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self, response):
+                # Replay the response text as a streamed JSON array of partial
+                # responses, which is what the SDK's REST transport reads
+                text = response['candidates'][0]['content']['parts'][0]['text']
+                size = -(-len(text) // GEMINI_STREAM_CHUNKS)
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                separator = '['
+                try:
+                    for start in range(0, len(text), size):
+                        time.sleep(services.gemini_latency / GEMINI_STREAM_CHUNKS)
+                        chunk = {
+                            'candidates': [{
+                                'content': {'role': 'model', 'parts': [{'text': text[start:start + size]}]},
+                                'index': 0,
+                            }],
+                            'usageMetadata': response['usageMetadata'],
+                        }
+                        self.wfile.write(f"{separator}{json.dumps(chunk)}\r\n".encode())
+                        self.wfile.flush()
+                        separator = ','
+                    self.wfile.write(b']')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading early (e.g. after the first item)
+                    pass
+
+            def log_message(self, format, *args):
+                # Keep benchmark output readable
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake Gemini/USDA server")
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--gemini-latency', type=float, default=0.0, help="Seconds per Gemini response")
+    parser.add_argument('--usda-latency', type=float, default=0.0, help="Seconds per USDA response")
+    args = parser.parse_args()
+
+    services = FakeServices(args.gemini_latency, args.usda_latency, port=args.port).start()
+    print(f"Fake services on {services.url}")
+    print(f"  GEMINI_API_ENDPOINT={services.url}")
+    print(f"  USDA_API_URL={services.usda_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        services.stop()
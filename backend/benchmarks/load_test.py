@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import psutil
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices
+from run_benchmarks import PICTURES, percentile
+
+DEFAULT_MIX = 'upload=4,analyze_tray=2,meal_history=3,video_feed=1'
+
+# Doubling the concurrency must raise throughput by at least this much
+# before we consider the server saturated
+SATURATION_GAIN = 0.10
+
+STAGE_SUM_RE = re.compile(r'^trayce_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class LoadWorker(threading.Thread):
+    """Fires a weighted mix of requests at the server until stop is set."""
+
+    def __init__(self, base_url, mix, image_bytes, stop, results, user):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.image_bytes = image_bytes
+        self.stop = stop
+        self.results = results
+        self.session = requests.Session()
+        self.session.post(f"{base_url}/load_test/login", params={'user': user}).raise_for_status()
+
+    def run(self):
+        while not self.stop.is_set():
+            name = random.choices(self.names, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = getattr(self, f"_{name}")()
+            except requests.RequestException:
+                ok = False
+            self.results.append((name, time.perf_counter() - start, ok))
+
+    # Every worker posts the same image as the same user; a fresh
+    # Idempotency-Key keeps those from being replayed from the idempotency cache
+    def _upload(self):
+        response = self.session.post(
+            f"{self.base_url}/upload", data=self.image_bytes,
+            headers={'Content-Type': 'image/jpeg', 'Idempotency-Key': uuid.uuid4().hex}
+        )
+        return response.status_code == 200
+
+    def _analyze_tray(self):
+        response = self.session.post(
+            f"{self.base_url}/analyze_tray", files={'file': ('load_test_tray.jpg', self.image_bytes, 'image/jpeg')},
+            headers={'Idempotency-Key': uuid.uuid4().hex}
+        )
+        return response.status_code == 200
+
+    def _meal_history(self):
+        return self.session.get(f"{self.base_url}/meal_history").status_code == 200
+
+    def _video_feed(self):
+        # Time to the first MJPEG frame; the stream itself never ends
+        with self.session.get(f"{self.base_url}/video_feed", stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                return False
+            for chunk in response.iter_content(chunk_size=4096):
+                if b'--frame' in chunk:
+                    return True
+            # No camera attached: the stream closes without frames
+            return False
+
+
+def read_stage_totals(base_url):
+    """Return {stage: (total_seconds, count)} scraped from /metrics."""
+    totals = defaultdict(lambda: [0.0, 0])
+    text = requests.get(f"{base_url}/metrics").text
+    for line in text.splitlines():
+        match = STAGE_SUM_RE.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            totals[stage][0 if kind == 'sum' else 1] = float(value)
+    return {stage: tuple(value) for stage, value in totals.items()}
+
+
+def run_level(base_url, mix, image_bytes, concurrency, duration, server):
+    """Run one concurrency level and return its throughput, latency and resource usage."""
+    stop = threading.Event()
+    results = []
+    workers = [
+        LoadWorker(base_url, mix, image_bytes, stop, results, f"loadtest{i}@example.com")
+        for i in range(concurrency)
+    ]
+    stages_before = read_stage_totals(base_url)
+
+    cpu_samples, rss_samples = [], []
+    if server:
+        server.cpu_percent()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    while time.perf_counter() - start < duration:
+        time.sleep(1)
+        if server:
+            cpu_samples.append(server.cpu_percent())
+            rss_samples.append(server.memory_info().rss / (1024 * 1024))
+    stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    # Mean time per call for each stage during this level only
+    stages_after = read_stage_totals(base_url)
+    stage_means = {}
+    for stage, (total, count) in stages_after.items():
+        before_total, before_count = stages_before.get(stage, (0.0, 0))
+        if count > before_count:
+            stage_means[stage] = (total - before_total) / (count - before_count)
+
+    endpoints = {}
+    for name in mix:
+        latencies = [latency for endpoint, latency, _ in results if endpoint == name]
+        if latencies:
+            endpoints[name] = {
+                'requests': len(latencies),
+                'errors': sum(1 for endpoint, _, ok in results if endpoint == name and not ok),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            }
+
+    level = {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'throughput_per_s': round(len(results) / elapsed, 2),
+        'server_cpu_percent': round(max(cpu_samples), 1) if cpu_samples else None,
+        'server_rss_mb': round(max(rss_samples), 1) if rss_samples else None,
+        'endpoints': endpoints,
+        'stage_mean_ms': {stage: round(mean * 1000, 2) for stage, mean in stage_means.items()},
+    }
+    print(
+        f"concurrency {concurrency:>3}: {level['throughput_per_s']:>8.2f} req/s, "
+        f"{level['errors']} errors, server CPU {level['server_cpu_percent']}%, RSS {level['server_rss_mb']} MB"
+    )
+    for name, stats in endpoints.items():
+        print(f"    {name:<14} p50 {stats['p50_ms']:>9.1f} ms  p99 {stats['p99_ms']:>9.1f} ms  errors {stats['errors']}")
+    return level
+
+
+def find_bottleneck(levels):
+    """
+    Identify the saturation point and the resource that limits it.
+
+    The saturation point is the first level where more concurrency stops
+    raising throughput. The bottleneck is the server CPU if one core is busy
+    (request handling is GIL-bound), otherwise the processing stage whose mean
+    latency grew the most from the first level, i.e. where requests queue.
+    """
+    saturated = levels[-1]
+    for previous, level in zip(levels, levels[1:]):
+        if level['throughput_per_s'] < previous['throughput_per_s'] * (1 + SATURATION_GAIN):
+            saturated = previous
+            break
+
+    if saturated['server_cpu_percent'] is not None and saturated['server_cpu_percent'] >= 90:
+        return saturated, f"server CPU ({saturated['server_cpu_percent']}%, GIL-bound Python work)"
+
+    baseline = levels[0]['stage_mean_ms']
+    growth = {
+        stage: mean - baseline[stage]
+        for stage, mean in levels[-1]['stage_mean_ms'].items()
+        if stage in baseline
+    }
+    if growth:
+        stage = max(growth, key=growth.get)
+        return saturated, f"stage '{stage}' (mean latency +{growth[stage]:.1f} ms from lowest concurrency)"
+    return saturated, "unknown (no stage timings recorded)"
+
+
+def spawn_server(port, services, db_path):
+    env = dict(
+        os.environ,
+        LOAD_TEST_MODE='1',
+        GEMINI_API_ENDPOINT=services.url,
+        USDA_API_URL=services.usda_url,
+        MEAL_DB_PATH=db_path,
+    )
+    env.setdefault('GEMINI_API_KEY', 'load-test')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--no-reload', '--no-debugger'],
+        cwd=BACKEND_DIR, env=env
+    )
+
+    # The app loads YOLO on import, so wait until it answers
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(120):
+        try:
+            requests.get(f"{base_url}/metrics", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            time.sleep(1)
+    process.terminate()
+    raise RuntimeError("Server did not start within 120s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the Flask backend with a mix of tray uploads")
+    parser.add_argument('--url', help="Base URL of a running instance started with LOAD_TEST_MODE=1 "
+                                      "(by default a local instance is spawned)")
+    parser.add_argument('--server-pid', type=int, help="PID of the running instance, for CPU/RSS sampling")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Weighted endpoint mix (default {DEFAULT_MIX})")
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help="Comma-separated concurrency levels")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per concurrency level")
+    parser.add_argument('--gemini-latency', type=float, default=0.8)
+    parser.add_argument('--usda-latency', type=float, default=0.1)
+    parser.add_argument('--output', help="Write the saturation curve as JSON to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    with open(PICTURES[0], 'rb') as f:
+        image_bytes = f.read()
+
+    with FakeServices(args.gemini_latency, args.usda_latency) as services:
+        process = None
+        if args.url:
+            base_url = args.url.rstrip('/')
+            server = psutil.Process(args.server_pid) if args.server_pid else None
+        else:
+            db_path = os.path.join(tempfile.mkdtemp(prefix='trayce-load-test-'), 'meal_history.db')
+            process, base_url = spawn_server(args.port, services, db_path)
+            server = psutil.Process(process.pid)
+
+        try:
+            levels = [
+                run_level(base_url, mix, image_bytes, int(concurrency), args.duration, server)
+                for concurrency in args.concurrency.split(',')
+            ]
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+    saturated, bottleneck = find_bottleneck(levels)
+    print(f"Saturates at concurrency {saturated['concurrency']} "
+          f"({saturated['throughput_per_s']} req/s); first bottleneck: {bottleneck}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'mix': mix,
+                'levels': levels,
+                'saturation_concurrency': saturated['concurrency'],
+                'bottleneck': bottleneck,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices, load_response, GEMINI_DEFAULT_RESPONSE
+
+PICTURES = sorted(glob.glob(os.path.join(BACKEND_DIR, 'pictures', 'lunchtray*.jpg')))
+BENCHMARK_USER = 'benchmark@example.com'
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(name, fn, iterations, warmup=1, items_per_call=1):
+    """
+    Run fn repeatedly and summarise its latency.
+
+    Returns:
+        Dict with throughput (items/s), p50/p99 latency in ms and the process's peak RSS so far
+    """
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+    total = time.perf_counter() - start
+
+    result = {
+        'name': name,
+        'iterations': iterations,
+        'throughput_per_s': round(iterations * items_per_call / total, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+    print(
+        f"{name:<28} {result['throughput_per_s']:>12.2f}/s  p50 {result['p50_ms']:>10.3f} ms  "
+        f"p99 {result['p99_ms']:>10.3f} ms  peak RSS {result['peak_rss_mb']:>8.1f} MB"
+    )
+    return result
+
+
+def bench_scoring(iterations):
+    from recyability import compute_tray_score, compute_tray_scores_batch
+
+    random.seed(0)
+    trays = [
+        [
+            {
+                'category': random.choice(['recycling', 'trash', 'compost', 'dish_return']),
+                'material': random.choice(['plastic', 'paper', 'styrofoam', '']),
+                'clean': random.random() < 0.5,
+                'contaminated': random.random() < 0.2,
+                'confidence': random.random(),
+            }
+            for _ in range(10)
+        ]
+        for _ in range(1000)
+    ]
+    flat = [(tray_id, item) for tray_id, tray in enumerate(trays) for item in tray]
+    columns = (
+        [tray_id for tray_id, _ in flat],
+        [item['category'] for _, item in flat],
+        [item['material'] for _, item in flat],
+        [item['clean'] for _, item in flat],
+        [item['contaminated'] for _, item in flat],
+        [item['confidence'] for _, item in flat],
+    )
+
+    return [
+        measure('compute_tray_score', lambda: [compute_tray_score(tray) for tray in trays],
+                iterations, items_per_call=len(trays)),
+        measure('compute_tray_scores_batch', lambda: compute_tray_scores_batch(*columns),
+                iterations, items_per_call=len(trays)),
+    ]
+
+
+def bench_gemini_parsing(iterations):
+    from PIL import Image
+    from gemini_spatial import GeminiSpatial
+
+    gemini = GeminiSpatial()
+    text = json.loads(load_response(GEMINI_DEFAULT_RESPONSE))['candidates'][0]['content']['parts'][0]['text']
+    boxes = gemini._parse_json(text)
+    image = Image.open(PICTURES[0]).convert('RGB')
+
+    return [
+        measure('gemini_parse_json', lambda: gemini._parse_json(text), iterations * 10),
+        measure('gemini_draw_boxes', lambda: gemini._draw_categorized_boxes(image.copy(), boxes), iterations),
+    ]
+
+
+def bench_gemini_analyze(iterations):
+    from gemini_spatial import GeminiSpatial
+
+    gemini = GeminiSpatial()
+
+    def first_streamed_item():
+        events = gemini.analyze_tray_stream(PICTURES[0])
+        next(events)
+        events.close()
+
+    return [
+        measure('gemini_analyze_tray', lambda: gemini.analyze_tray(PICTURES[0]), iterations),
+        measure('gemini_stream_first_item', first_streamed_item, iterations),
+        measure('gemini_analyze_tray_stream', lambda: list(gemini.analyze_tray_stream(PICTURES[0])), iterations),
+    ]
+
+
+def bench_process_image(iterations):
+    import app
+
+    return [
+        measure(f"process_image[{os.path.basename(path)}]", lambda path=path: app.process_image(path), iterations)
+        for path in PICTURES
+    ]
+
+
+def bench_routes(iterations):
+    import app
+
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = BENCHMARK_USER
+
+    with open(PICTURES[0], 'rb') as f:
+        image_bytes = f.read()
+
+    # The same image from the same user would otherwise be replayed from the
+    # idempotency cache; a fresh Idempotency-Key makes every request run
+    def upload():
+        response = client.post(
+            '/upload', data=image_bytes, content_type='image/jpeg',
+            headers={'Idempotency-Key': uuid.uuid4().hex}
+        )
+        assert response.status_code == 200, response.status_code
+
+    def analyze_tray():
+        response = client.post(
+            '/analyze_tray',
+            data={'file': (io.BytesIO(image_bytes), 'benchmark_tray.jpg')},
+            content_type='multipart/form-data',
+            headers={'Idempotency-Key': uuid.uuid4().hex}
+        )
+        assert response.status_code == 200, response.status_code
+
+    def meal_history():
+        response = client.get('/meal_history')
+        assert response.status_code == 200, response.status_code
+
+    return [
+        measure('route /upload', upload, iterations),
+        measure('route /analyze_tray', analyze_tray, iterations),
+        measure('route /meal_history', meal_history, iterations),
+    ]
+
+
+# Ordered from cheapest to most memory-hungry, since peak RSS only grows
+BENCHMARKS = [
+    ('scoring', bench_scoring),
+    ('gemini_parsing', bench_gemini_parsing),
+    ('gemini_analyze', bench_gemini_analyze),
+    ('process_image', bench_process_image),
+    ('routes', bench_routes),
+]
+
+
+def compare_to_baseline(results, baseline_path, max_regression):
+    """Print p50 changes against a previous run. Returns the names that regressed."""
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['name'])
+        if not previous or not previous['p50_ms']:
+            continue
+        change = result['p50_ms'] / previous['p50_ms'] - 1
+        print(f"{result['name']:<28} p50 {change:+.1%} vs baseline")
+        if change > max_regression:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Trayce backend benchmarks offline")
+    parser.add_argument('--only', nargs='*', help="Benchmark groups to run: " + ", ".join(name for name, _ in BENCHMARKS))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--gemini-latency', type=float, default=0.0, help="Seconds the fake Gemini API waits per call")
+    parser.add_argument('--usda-latency', type=float, default=0.0, help="Seconds the fake USDA API waits per call")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON from a previous run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="Fail if any p50 is this fraction slower than the baseline")
+    args = parser.parse_args()
+
+    with FakeServices(args.gemini_latency, args.usda_latency) as services, tempfile.TemporaryDirectory() as tmp:
+        # Must be set before gemini_spatial/app are imported
+        os.environ['GEMINI_API_ENDPOINT'] = services.url
+        os.environ['USDA_API_URL'] = services.usda_url
+        os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+        os.environ['MEAL_DB_PATH'] = os.path.join(tmp, 'meal_history.db')
+        os.chdir(BACKEND_DIR)
+
+        results = []
+        for name, bench in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            print(f"== {name}")
+            try:
+                results.extend(bench(args.iterations))
+            except ImportError as e:
+                print(f"   skipped: {e}")
+
+        print(f"Fake service calls: {services.request_counts}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            print(f"Regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
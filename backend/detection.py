@@ -0,0 +1,77 @@
+import threading
+
+import cv2
+
+# COCO dataset class names
+COCO_CLASSES = [
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat',
+    'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat',
+    'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack',
+    'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball',
+    'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket',
+    'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
+    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair',
+    'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote',
+    'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book',
+    'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush'
+]
+
+# Whitelist: Only these classes will be shown
+# Modify this list to include only the classes you want to detect
+WHITELIST_CLASSES = [
+    'bottle', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
+    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake',
+    'chair', 'dining table', 'person'
+]
+
+# Confidence threshold for detections (0.0 to 1.0)
+# Lower this value to show more detections with lower confidence
+# Increase this value to only show high-confidence detections
+CONFIDENCE_THRESHOLD = 0.30  # Default is 0.25 (25%)
+
+# Ultralytics predictors are not thread-safe; every call into the shared YOLO
+# model (request threads, detection sockets, the lane scheduler) holds this lock
+MODEL_LOCK = threading.Lock()
+
+def extract_detections(result):
+    """
+    Convert one YOLO result into whitelisted detections.
+
+    Args:
+        result: A single ultralytics Results object
+
+    Returns:
+        List of dicts with class, confidence and box ([x1, y1, x2, y2] pixels)
+    """
+    detections = []
+    for box in result.boxes:
+        class_id = int(box.cls.item())
+        class_name = COCO_CLASSES[class_id]
+        
+        # Only include classes in the whitelist
+        if class_name in WHITELIST_CLASSES:
+            # Get coordinates and confidence
+            x1, y1, x2, y2 = box.xyxy[0].tolist()
+            confidence = box.conf.item()
+            
+            detections.append({
+                'class': class_name,
+                'confidence': float(confidence),
+                'box': [int(x1), int(y1), int(x2), int(y2)]
+            })
+    return detections
+
+def draw_detections(image, detections):
+    """Return a copy of the image with detection boxes and labels drawn on it."""
+    annotated_image = image.copy()
+    for detection in detections:
+        x1, y1, x2, y2 = detection['box']
+        
+        # Draw bounding box
+        cv2.rectangle(annotated_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        
+        # Add label with class name and confidence
+        label = f"{detection['class']}: {detection['confidence']:.2f}"
+        cv2.putText(annotated_image, label, (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return annotated_image
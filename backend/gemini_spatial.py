@@ -1,17 +1,30 @@
 import os
 import json
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ImageDraw, ImageFont
 import base64
 import io
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
 from google.generativeai import types
+from metrics import timer, timed, record
+from json_stream import IncrementalArrayParser
+from image_ingest import ARCHIVE_IMAGE_SIZE, ARCHIVE_JPEG_QUALITY, open_pil_image
+from image_policy import load_image_policy, prepare_gemini_image, uncrop_items
 
 # Load environment variables
 load_dotenv()
 
-# Configure the Gemini API client
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+# Configure the Gemini API client; GEMINI_API_ENDPOINT points it at another
+# server speaking the REST API (e.g. the benchmark stand-in)
+if os.getenv('GEMINI_API_ENDPOINT'):
+    genai.configure(
+        api_key=os.getenv('GEMINI_API_KEY'),
+        transport='rest',
+        client_options={'api_endpoint': os.getenv('GEMINI_API_ENDPOINT')}
+    )
+else:
+    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
 # System instructions for bounding box detection
 BOUNDING_BOX_SYSTEM_INSTRUCTIONS = """
@@ -27,9 +40,37 @@ SAFETY_SETTINGS = [
     ),
 ]
 
+# Prompt for categorizing tray items by disposal stream
+TRAY_ANALYSIS_PROMPT = """
+        Analyze this lunch tray image. Identify all food items, containers, and utensils.
+        For each item, determine which disposal category it belongs to:
+        - Trash (non-recyclable items)
+        - Recycling (plastic, metal, glass containers, apple sauce, Plastic utensils)
+        - Compost (food waste, napkins, paper products)
+        - Dish Return (reusable trays, plates, silverware, glass products)
+
+        
+        Return the results as a JSON array with these fields:
+        - label: name of the item
+        - category: disposal category (trash, recycling, compost, dish_return)
+        - box_2d: bounding box coordinates [y1, x1, y2, x2] in normalized 0-1000 range
+        """
+
 class GeminiSpatial:
-    def __init__(self):
+    def __init__(self, image_policy=None):
+        """
+        Args:
+            image_policy: Dict controlling the image sent to Gemini
+                (see image_policy.load_image_policy); defaults to the configured policy
+        """
         self.model_name = "gemini-2.0-flash"
+        self.image_policy = image_policy or load_image_policy()
+        
+        # Bounding box calls share one model carrying the system instructions
+        self.box_model = genai.GenerativeModel(
+            model_name=self.model_name,
+            system_instruction=BOUNDING_BOX_SYSTEM_INSTRUCTIONS
+        )
     
     def detect_objects(self, image_path, prompt="Identify all objects in this image"):
         """
@@ -43,138 +84,171 @@ class GeminiSpatial:
             Tuple of (annotated_image_base64, detection_results)
         """
         try:
-            # Load the image
-            img = Image.open(image_path)
-            
-            # Convert the image to RGB if it's not already
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Create a copy for annotation
-            annotated_img = img.copy()
-            
-            # Resize image if needed
-            img.thumbnail([1024, 1024], Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
-            
-            # Convert PIL Image to bytes for Gemini API
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG')
-            img_bytes = img_byte_arr.getvalue()
-            
-            # Add system instructions to the prompt
-            full_prompt = BOUNDING_BOX_SYSTEM_INSTRUCTIONS + "\n\n" + prompt
-            
-            # Create Gemini model
-            model = genai.GenerativeModel(model_name=self.model_name)
-            
-            # Generate content
-            response = model.generate_content(
-                contents=[
-                    full_prompt,
-                    {"mime_type": "image/jpeg", "data": img_bytes}
-                ],
-                generation_config=genai.GenerationConfig(
-                    temperature=0.5,
-                ),
-                safety_settings=SAFETY_SETTINGS
-            )
+            annotated_img, img_bytes, region = self._prepare_image(image_path)
             
-            # Parse the response
-            bounding_boxes = self._parse_json(response.text)
+            response = self._generate_content(prompt, img_bytes)
             
-            # Draw bounding boxes on the image
-            annotated_img = self._draw_bounding_boxes(annotated_img, bounding_boxes)
+            # Parse the response, with boxes relative to the whole image
+            detections = uncrop_items(json.loads(self._parse_json(response.text)), region)
             
-            # Convert the annotated image to base64
-            buffered = io.BytesIO()
-            annotated_img.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            # Draw bounding boxes on the image
+            annotated_img = self._draw_bounding_boxes(annotated_img, json.dumps(detections))
             
-            return img_str, json.loads(bounding_boxes)
+            return self._encode_image(annotated_img), detections
             
         except Exception as e:
             print(f"Error in detect_objects: {e}")
             return None, {"error": str(e)}
     
-    def analyze_tray(self, image_path):
+    def analyze_tray(self, image_path, annotate=True, resolve_item=None):
         """
         Analyze a lunch tray image and categorize items for disposal
         
         Args:
             image_path: Path to the image file
+            annotate: Whether to draw and encode the annotated image
+            resolve_item: Optional function called with each item before it
+                is drawn, which may update it in place (e.g. its category)
             
         Returns:
-            Tuple of (annotated_image_base64, categorized_items)
+            Tuple of (annotated_image_base64, categorized_items);
+            the image is None when annotate is False
         """
-        prompt = """
-        Analyze this lunch tray image. Identify all food items, containers, and utensils.
-        For each item, determine which disposal category it belongs to:
-        - Trash (non-recyclable items)
-        - Recycling (plastic, metal, glass containers, apple sauce, Plastic utensils)
-        - Compost (food waste, napkins, paper products)
-        - Dish Return (reusable trays, plates, silverware, glass products)
-
-        
-        Return the results as a JSON array with these fields:
-        - label: name of the item
-        - category: disposal category (trash, recycling, compost, dish_return)
-        - box_2d: bounding box coordinates [y1, x1, y2, x2] in normalized 0-1000 range
-        """
-        
         try:
-            # Load the image
-            img = Image.open(image_path)
-            
-            # Convert the image to RGB if it's not already
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Create a copy for annotation
-            annotated_img = img.copy()
-            
-            # Resize image if needed
-            img.thumbnail([1024, 1024], Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
-            
-            # Convert PIL Image to bytes for Gemini API
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG')
-            img_bytes = img_byte_arr.getvalue()
-            
-            # Add system instructions to the prompt
-            full_prompt = BOUNDING_BOX_SYSTEM_INSTRUCTIONS + "\n\n" + prompt
-            
-            # Create Gemini model
-            model = genai.GenerativeModel(model_name=self.model_name)
-            
-            # Generate content
-            response = model.generate_content(
-                contents=[
-                    full_prompt,
-                    {"mime_type": "image/jpeg", "data": img_bytes}
-                ],
-                generation_config=genai.GenerationConfig(
-                    temperature=0.5,
-                ),
-                safety_settings=SAFETY_SETTINGS
-            )
+            annotated_img, img_bytes, region = self._prepare_image(image_path)
             
-            # Parse the response
-            bounding_boxes = self._parse_json(response.text)
+            response = self._generate_content(TRAY_ANALYSIS_PROMPT, img_bytes)
             
-            # Draw categorized bounding boxes on the image
-            annotated_img = self._draw_categorized_boxes(annotated_img, bounding_boxes)
+            # Parse the response, with boxes relative to the whole image
+            items = uncrop_items(json.loads(self._parse_json(response.text)), region)
+            self._resolve_items(items, resolve_item)
             
-            # Convert the annotated image to base64
-            buffered = io.BytesIO()
-            annotated_img.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            if not annotate:
+                return None, items
             
-            return img_str, json.loads(bounding_boxes)
+            # Draw categorized bounding boxes on the image
+            annotated_img = self._draw_categorized_boxes(annotated_img, json.dumps(items))
+            
+            return self._encode_image(annotated_img), items
             
         except Exception as e:
             print(f"Error in analyze_tray: {e}")
             return None, {"error": str(e)}
     
+    def analyze_tray_stream(self, image_path, resolve_item=None):
+        """
+        Analyze a lunch tray image like analyze_tray, streaming the response
+        
+        Items are parsed out of the response while Gemini is still generating
+        it, so callers can show the first boxes long before the full answer
+        has arrived.
+        
+        Args:
+            image_path: Path to the image file
+            resolve_item: Optional function called with each item before it
+                is yielded or drawn, as in analyze_tray
+            
+        Yields:
+            ("item", item) for each categorized item as soon as it is complete,
+            then ("done", (annotated_image_base64, categorized_items)),
+            or ("error", message) if the analysis fails
+        """
+        try:
+            annotated_img, img_bytes, region = self._prepare_image(image_path)
+            
+            start = time.perf_counter()
+            response = self._generate_content(TRAY_ANALYSIS_PROMPT, img_bytes, stream=True)
+            
+            parser = IncrementalArrayParser()
+            items = []
+            chunks = []
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text (e.g. only a finish reason or safety ratings)
+                    continue
+                chunks.append(text)
+                
+                for item in parser.feed(text):
+                    if not isinstance(item, dict):
+                        continue
+                    if not items:
+                        record('gemini_first_item', time.perf_counter() - start)
+                    item = uncrop_items([item], region)[0]
+                    self._resolve_items([item], resolve_item)
+                    items.append(item)
+                    yield 'item', item
+            record('gemini_generate', time.perf_counter() - start)
+            
+            if not items:
+                # Nothing could be parsed incrementally; fall back to the full response
+                items = uncrop_items(json.loads(self._parse_json("".join(chunks))), region)
+                self._resolve_items(items, resolve_item)
+                for item in items:
+                    yield 'item', item
+            
+            # Draw categorized bounding boxes on the image
+            annotated_img = self._draw_categorized_boxes(annotated_img, json.dumps(items))
+            
+            yield 'done', (self._encode_image(annotated_img), items)
+            
+        except Exception as e:
+            print(f"Error in analyze_tray_stream: {e}")
+            yield 'error', str(e)
+    
+    def _resolve_items(self, items, resolve_item):
+        if resolve_item is None or not isinstance(items, list):
+            return
+        for item in items:
+            if isinstance(item, dict):
+                resolve_item(item)
+    
+    def _prepare_image(self, image_path):
+        """
+        Load an image and encode the copy sent to Gemini according to the image policy
+        
+        Returns:
+            Tuple of (image_for_annotation, jpeg_bytes_for_gemini, region), where
+            region is the part of the image that was sent (see image_policy.uncrop_items)
+        """
+        # Load the image as RGB at the archive size (large JPEGs are decoded at reduced scale)
+        with timer('gemini_prepare_image'):
+            img = open_pil_image(image_path, ARCHIVE_IMAGE_SIZE)
+            img_bytes, region = prepare_gemini_image(img, self.image_policy)
+            return img, img_bytes, region
+    
+    def _generate_content(self, prompt, img_bytes, stream=False):
+        """
+        Send a bounding box prompt and image to Gemini
+        
+        With stream=True the response is returned as soon as the request is
+        sent and yields chunks as they are generated; the caller times it.
+        """
+        request = dict(
+            contents=[
+                prompt,
+                {"mime_type": "image/jpeg", "data": img_bytes}
+            ],
+            generation_config=genai.GenerationConfig(
+                temperature=0.5,
+            ),
+            safety_settings=SAFETY_SETTINGS,
+        )
+        if stream:
+            return self.box_model.generate_content(stream=True, **request)
+        
+        # Generate content
+        with timer('gemini_generate'):
+            return self.box_model.generate_content(**request)
+    
+    def _encode_image(self, img):
+        """Convert an annotated image to base64 JPEG"""
+        with timer('gemini_encode'):
+            buffered = io.BytesIO()
+            img.save(buffered, format="JPEG", quality=ARCHIVE_JPEG_QUALITY)
+            return base64.b64encode(buffered.getvalue()).decode()
+    
     def identify_food_items(self, categorized_items):
         """
         Use Gemini to identify which items in the categorized_items list are food items.
@@ -204,7 +278,8 @@ class GeminiSpatial:
                 safety_settings=SAFETY_SETTINGS
             )
             
-            response = model.generate_content(prompt)
+            with timer('gemini_identify_food'):
+                response = model.generate_content(prompt)
             
             # Parse the response
             if hasattr(response, 'text'):
@@ -247,6 +322,7 @@ class GeminiSpatial:
             # Fallback to returning all items
             return categorized_items
     
+    @timed('gemini_parse')
     def _parse_json(self, json_output):
         """
         Parse JSON from the model response, handling potential formatting issues
@@ -279,6 +355,7 @@ class GeminiSpatial:
             # Return empty array as fallback
             return "[]"
     
+    @timed('gemini_annotate')
     def _draw_bounding_boxes(self, img, bounding_boxes_json):
         """
         Draw bounding boxes on an image
@@ -350,6 +427,7 @@ class GeminiSpatial:
             print(f"Error drawing bounding boxes: {e}")
             return img
     
+    @timed('gemini_annotate')
     def _draw_categorized_boxes(self, img, bounding_boxes_json):
         """
         Draw categorized bounding boxes on an image
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a result stays replayable for a client-supplied Idempotency-Key
+IDEMPOTENCY_KEY_TTL = float(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Seconds after a result during which the same user sending the same image to
+# the same endpoint without a key gets that result again (double clicks, retries)
+IDEMPOTENCY_WINDOW = float(os.getenv('IDEMPOTENCY_WINDOW', 10))
+
+# Completed results kept in memory; each holds a full response (with its
+# base64 image), so this bounds the cache to a few tens of MB
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 128))
+
+# Longest a duplicate waits for the first request's result
+WAIT_TIMEOUT = 300
+
+# Longest accepted Idempotency-Key header
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different request."""
+
+
+class IdempotencyTimeout(TimeoutError):
+    """A duplicate gave up waiting for the original request's result."""
+
+
+class _Entry:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires_at = None
+
+
+class Claim:
+    """
+    A request's hold on a key of an IdempotencyCache, from IdempotencyCache.claim().
+
+    The owner (the first request for the key) produces the result and ends
+    the claim with complete() or fail(); release() fails it if neither
+    happened, e.g. when a streamed response is closed early. Any other
+    request calls wait() for the owner's result.
+    """
+
+    def __init__(self, cache, key, entry, owner, ttl):
+        self.owner = owner
+        self._cache = cache
+        self._key = key
+        self._entry = entry
+        self._ttl = ttl
+
+    def wait(self):
+        """
+        Return the owner's result, waiting for it if it is still being produced.
+
+        Raises:
+            IdempotencyTimeout: If the owner took longer than WAIT_TIMEOUT
+            Exception: Whatever the owner failed with
+        """
+        entry = self._entry
+        if not entry.done.is_set():
+            with self._cache._lock:
+                self._cache.waited += 1
+            if not entry.done.wait(WAIT_TIMEOUT):
+                raise IdempotencyTimeout('Timed out waiting for the original request')
+        if entry.error is not None:
+            raise entry.error
+        with self._cache._lock:
+            self._cache.replayed += 1
+        return entry.result
+
+    def complete(self, result):
+        """Store the owner's result for duplicates."""
+        if not self.owner or self._entry.done.is_set():
+            return
+        self._entry.result = result
+        with self._cache._lock:
+            self._cache.computed += 1
+        self._finish()
+
+    def fail(self, error):
+        """Discard the claim; waiting duplicates get error and the next request starts over."""
+        if not self.owner or self._entry.done.is_set():
+            return
+        self._entry.error = error
+        with self._cache._lock:
+            if self._cache._entries.get(self._key) is self._entry:
+                del self._cache._entries[self._key]
+        self._finish()
+
+    def release(self):
+        """Fail the claim if the owner ended without completing it."""
+        self.fail(RuntimeError('The original request did not complete'))
+
+    def _finish(self):
+        self._entry.expires_at = time.monotonic() + self._ttl
+        self._entry.done.set()
+
+
+class IdempotencyCache:
+    """
+    Runs a computation once per key and replays its result to duplicates.
+
+    The first call for a key computes the result; calls with the same key
+    while it runs wait for it instead of starting their own, and calls after
+    it finished get the stored result until it expires. A computation that
+    raises is not stored: waiting duplicates get the same exception and the
+    next call computes again. Results live in this process only. claim()
+    exposes the same protocol for results produced incrementally.
+
+    Usage:
+        result, replayed = cache.run(('alice', 'upload', key), compute, ttl, fingerprint=image_hash)
+    """
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.computed = 0
+        self.replayed = 0
+        self.waited = 0
+
+    def run(self, key, compute, ttl, fingerprint=None):
+        """
+        Return (result, replayed) for key, calling compute() only if needed.
+
+        Args:
+            key: Hashable key of the request
+            compute: Function returning the result
+            ttl: Seconds the result stays replayable after it is computed
+            fingerprint: Identifies the request body; a key reused with a
+                different fingerprint is a conflict
+
+        Raises:
+            IdempotencyConflict: If key was used with a different fingerprint
+            IdempotencyTimeout: If an in-flight duplicate took longer than WAIT_TIMEOUT
+            Exception: Whatever compute() raised
+        """
+        claim = self.claim(key, ttl, fingerprint)
+        if not claim.owner:
+            return claim.wait(), True
+
+        try:
+            result = compute()
+            claim.complete(result)
+        except Exception as e:
+            claim.fail(e)
+            raise
+        finally:
+            claim.release()
+        return result, False
+
+    def claim(self, key, ttl, fingerprint=None):
+        """
+        Claim key for a request, as run() does, without computing anything.
+
+        Returns:
+            Claim whose owner attribute says whether this request must
+            produce the result
+
+        Raises:
+            IdempotencyConflict: If key was used with a different fingerprint
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None and entry.fingerprint != fingerprint:
+                raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry(fingerprint)
+        return Claim(self, key, entry, owner, ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'computed': self.computed,
+                'replayed': self.replayed,
+                'waited': self.waited,
+            }
+
+    def _evict(self, now):
+        # Expired results go first, then the oldest completed ones over the
+        # limit; in-flight entries are never evicted
+        for key, entry in list(self._entries.items()):
+            if entry.done.is_set() and entry.expires_at <= now:
+                del self._entries[key]
+        if len(self._entries) > self.max_entries:
+            for key, entry in list(self._entries.items()):
+                if len(self._entries) <= self.max_entries:
+                    break
+                if entry.done.is_set():
+                    del self._entries[key]
@@ -0,0 +1,103 @@
+import os
+
+import cv2
+from PIL import Image
+
+# Longest side of the image handed to YOLO (matches its default imgsz)
+MODEL_IMAGE_SIZE = int(os.getenv('MODEL_IMAGE_SIZE', 640))
+
+# Longest side of the annotated copy returned to the client and stored in meal history
+ARCHIVE_IMAGE_SIZE = int(os.getenv('ARCHIVE_IMAGE_SIZE', 1280))
+ARCHIVE_JPEG_QUALITY = int(os.getenv('ARCHIVE_JPEG_QUALITY', 85))
+
+# OpenCV can decode JPEGs directly at 1/2, 1/4 or 1/8 scale in the DCT domain
+REDUCED_JPEG_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def read_image(image_path, max_size):
+    """
+    Decode an image with OpenCV so its longest side is at most max_size.
+
+    JPEGs are decoded at a reduced scale when the original is at least twice
+    as large as needed, which is much cheaper than a full decode and resize.
+
+    Args:
+        image_path: Path to the image file
+        max_size: Maximum length of the longest side in pixels
+
+    Returns:
+        Tuple of (BGR image, scale) where scale maps image pixels back to
+        original pixels, or (None, 1.0) if the image could not be read
+    """
+    try:
+        # Only reads the header
+        with Image.open(image_path) as img:
+            original_longest = max(img.size)
+            is_jpeg = img.format == 'JPEG'
+    except OSError:
+        return None, 1.0
+
+    flag = cv2.IMREAD_COLOR
+    if is_jpeg:
+        for factor, reduced_flag in REDUCED_JPEG_FLAGS:
+            if original_longest / factor >= max_size:
+                flag = reduced_flag
+                break
+
+    image = cv2.imread(image_path, flag)
+    if image is None:
+        return None, 1.0
+
+    image, _ = resize_to_fit(image, max_size)
+    return image, original_longest / max(image.shape[:2])
+
+
+def resize_to_fit(image, max_size):
+    """
+    Downscale a BGR image so its longest side is at most max_size (never upscales).
+
+    Returns:
+        Tuple of (image, scale) where scale maps resized pixels back to input pixels
+    """
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if longest <= max_size:
+        return image, 1.0
+
+    ratio = max_size / longest
+    resized = cv2.resize(image, (round(width * ratio), round(height * ratio)), interpolation=cv2.INTER_AREA)
+    return resized, longest / max(resized.shape[:2])
+
+
+def scale_detections(detections, scale):
+    """Return copies of YOLO detections with their boxes multiplied by scale."""
+    if scale == 1.0:
+        return detections
+    return [
+        dict(detection, box=[int(round(coord * scale)) for coord in detection['box']])
+        for detection in detections
+    ]
+
+
+def open_pil_image(image_path, max_size):
+    """
+    Open an image with PIL as RGB with its longest side at most max_size.
+
+    Uses JPEG draft mode so large JPEGs are decoded at a reduced scale.
+    """
+    img = Image.open(image_path)
+    img.draft('RGB', (max_size, max_size))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail([max_size, max_size], Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
+    return img
+
+
+def encode_archive_jpeg(image):
+    """Encode a BGR image as JPEG bytes at the archive quality."""
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, ARCHIVE_JPEG_QUALITY])
+    return buffer
@@ -0,0 +1,173 @@
+import io
+import math
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Named settings for the image sent to Gemini. "default" is what was always
+# sent (1024px, PIL's default JPEG quality); the others trade detail for tokens.
+#   max_size: longest side in pixels
+#   quality: JPEG quality
+#   grayscale: drop colour (smaller upload, same token count)
+#   crop_to_tray: crop to the tray found by find_tray_region() first
+IMAGE_POLICIES = {
+    'default': {'max_size': 1024, 'quality': 75, 'grayscale': False, 'crop_to_tray': False},
+    'tile768': {'max_size': 768, 'quality': 75, 'grayscale': False, 'crop_to_tray': False},
+    'tile768_tray': {'max_size': 768, 'quality': 75, 'grayscale': False, 'crop_to_tray': True},
+    'tile768_gray': {'max_size': 768, 'quality': 75, 'grayscale': True, 'crop_to_tray': True},
+    'small384_tray': {'max_size': 384, 'quality': 85, 'grayscale': False, 'crop_to_tray': True},
+}
+
+# Gemini bills an image that fits in 384x384 as one 258-token tile; larger
+# images are split into 768x768 tiles of 258 tokens each
+GEMINI_SMALL_IMAGE_SIZE = 384
+GEMINI_TILE_SIZE = 768
+GEMINI_TOKENS_PER_TILE = 258
+
+# Longest side of the copy the tray detector works on
+TRAY_DETECTOR_SIZE = 128
+
+# Smallest tray, as a fraction of the image area, that is trusted for cropping
+MIN_TRAY_AREA = 0.25
+
+# Margin added around the detected tray, as a fraction of its size
+TRAY_MARGIN = 0.03
+
+FULL_REGION = (0.0, 0.0, 1.0, 1.0)
+
+
+def load_image_policy(name=None):
+    """
+    Return the image policy to use for Gemini requests.
+
+    The preset comes from `name` or the GEMINI_IMAGE_POLICY environment
+    variable (default "default"); GEMINI_IMAGE_SIZE, GEMINI_JPEG_QUALITY,
+    GEMINI_GRAYSCALE and GEMINI_CROP_TO_TRAY override single settings.
+
+    Raises:
+        ValueError: If the preset does not exist
+    """
+    name = name or os.getenv('GEMINI_IMAGE_POLICY', 'default')
+    if name not in IMAGE_POLICIES:
+        raise ValueError(f"Unknown image policy '{name}' (choose from {', '.join(IMAGE_POLICIES)})")
+
+    policy = dict(IMAGE_POLICIES[name], name=name)
+    if os.getenv('GEMINI_IMAGE_SIZE'):
+        policy['max_size'] = int(os.getenv('GEMINI_IMAGE_SIZE'))
+    if os.getenv('GEMINI_JPEG_QUALITY'):
+        policy['quality'] = int(os.getenv('GEMINI_JPEG_QUALITY'))
+    if os.getenv('GEMINI_GRAYSCALE'):
+        policy['grayscale'] = os.getenv('GEMINI_GRAYSCALE') == '1'
+    if os.getenv('GEMINI_CROP_TO_TRAY'):
+        policy['crop_to_tray'] = os.getenv('GEMINI_CROP_TO_TRAY') == '1'
+    return policy
+
+
+def estimate_image_tokens(width, height):
+    """Estimate the prompt tokens Gemini charges for an image of this size."""
+    if width <= GEMINI_SMALL_IMAGE_SIZE and height <= GEMINI_SMALL_IMAGE_SIZE:
+        return GEMINI_TOKENS_PER_TILE
+    tiles = math.ceil(width / GEMINI_TILE_SIZE) * math.ceil(height / GEMINI_TILE_SIZE)
+    return tiles * GEMINI_TOKENS_PER_TILE
+
+
+def find_tray_region(img):
+    """
+    Find the tray in a photo with a cheap local detector.
+
+    The background colour is taken from the image border; the tray is the
+    largest connected area that differs from it, measured on a 128px copy.
+
+    Args:
+        img: RGB PIL image
+
+    Returns:
+        (left, top, right, bottom) as fractions of the image size, or None if
+        no tray large enough to trust was found
+    """
+    small = img.copy()
+    small.thumbnail([TRAY_DETECTOR_SIZE, TRAY_DETECTOR_SIZE])
+    lab = cv2.cvtColor(np.asarray(small), cv2.COLOR_RGB2LAB).astype(np.float32)
+    height, width = lab.shape[:2]
+
+    border = np.concatenate([lab[0], lab[-1], lab[:, 0], lab[:, -1]])
+    distance = np.linalg.norm(lab - np.median(border, axis=0), axis=2)
+    distance = cv2.GaussianBlur(np.clip(distance, 0, 255).astype(np.uint8), (5, 5), 0)
+    _, mask = cv2.threshold(distance, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    if w * h < MIN_TRAY_AREA * width * height:
+        return None
+
+    margin_x, margin_y = w * TRAY_MARGIN, h * TRAY_MARGIN
+    return (
+        max(0.0, (x - margin_x) / width),
+        max(0.0, (y - margin_y) / height),
+        min(1.0, (x + w + margin_x) / width),
+        min(1.0, (y + h + margin_y) / height),
+    )
+
+
+def prepare_gemini_image(img, policy):
+    """
+    Encode the copy of an image sent to Gemini according to a policy.
+
+    Args:
+        img: RGB PIL image (not modified)
+        policy: Dict from load_image_policy()
+
+    Returns:
+        Tuple of (jpeg_bytes, region) where region is the (left, top, right,
+        bottom) part of img that was sent, as fractions of its size
+    """
+    region = FULL_REGION
+    if policy['crop_to_tray']:
+        region = find_tray_region(img) or FULL_REGION
+
+    if region == FULL_REGION:
+        img = img.copy()
+    else:
+        width, height = img.size
+        left, top, right, bottom = region
+        img = img.crop((round(left * width), round(top * height), round(right * width), round(bottom * height)))
+
+    img.thumbnail([policy['max_size'], policy['max_size']], Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
+    if policy['grayscale']:
+        img = img.convert('L')
+
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='JPEG', quality=policy['quality'])
+    return img_byte_arr.getvalue(), region
+
+
+def uncrop_items(items, region):
+    """
+    Map Gemini box_2d coordinates from a cropped region back to the full image.
+
+    Boxes are [y1, x1, y2, x2] normalized to 0-1000; items without a box are
+    returned unchanged.
+    """
+    if region == FULL_REGION or not isinstance(items, list):
+        return items
+
+    left, top, right, bottom = region
+    mapped = []
+    for item in items:
+        box = item.get('box_2d') if isinstance(item, dict) else None
+        if not isinstance(box, list) or len(box) != 4:
+            mapped.append(item)
+            continue
+        y1, x1, y2, x2 = box
+        mapped.append(dict(item, box_2d=[
+            round(top * 1000 + y1 * (bottom - top)),
+            round(left * 1000 + x1 * (right - left)),
+            round(top * 1000 + y2 * (bottom - top)),
+            round(left * 1000 + x2 * (right - left)),
+        ]))
+    return mapped
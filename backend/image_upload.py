@@ -0,0 +1,117 @@
+import binascii
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Magic numbers of the image formats we accept
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'BM', 'image/bmp'),
+]
+
+# Enough bytes to recognise every signature above (and RIFF....WEBP)
+HEADER_SIZE = 12
+
+# Size of each read from the request stream
+CHUNK_SIZE = 64 * 1024
+
+
+def sniff_image_type(header):
+    """
+    Return the image MIME type for the first bytes of a file, or None if
+    they do not look like a supported image.
+    """
+    header = bytes(header[:HEADER_SIZE])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def read_image_stream(stream, max_bytes, content_length=None):
+    """
+    Read an image from a file-like stream into a single bounded buffer.
+
+    The first bytes are checked against the known image signatures before the
+    rest of the body is read, so non-images are rejected without buffering them.
+    When the content length is known the buffer is allocated once and filled
+    in place.
+
+    Args:
+        stream: Readable binary stream (request.stream or an uploaded file)
+        max_bytes: Maximum number of bytes to accept
+        content_length: Expected size in bytes, if known
+
+    Returns:
+        bytearray with the image bytes
+
+    Raises:
+        ValueError: If the data is not a supported image
+        RequestEntityTooLarge: If the image is larger than max_bytes
+    """
+    if content_length is not None and content_length > max_bytes:
+        raise RequestEntityTooLarge()
+
+    header = stream.read(HEADER_SIZE)
+    if sniff_image_type(header) is None:
+        raise ValueError('Uploaded data is not a supported image')
+
+    if content_length:
+        # Fill a preallocated buffer without intermediate chunk copies
+        buffer = bytearray(content_length)
+        view = memoryview(buffer)
+        view[:len(header)] = header
+        filled = len(header)
+        while filled < content_length:
+            read = stream.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+        return buffer[:filled] if filled < content_length else buffer
+
+    buffer = bytearray(header)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(buffer) + len(chunk) > max_bytes:
+            raise RequestEntityTooLarge()
+        buffer += chunk
+    return buffer
+
+
+def decode_data_url(body):
+    """
+    Decode the base64 image inside a {"image": "data:image/...;base64,..."} JSON body.
+
+    Works on the raw request bytes instead of parsing the JSON into a string,
+    so only the body and the decoded image are held in memory. The first few
+    bytes are decoded and checked before the rest.
+
+    Args:
+        body: Raw request body as bytes
+
+    Returns:
+        Decoded image bytes
+
+    Raises:
+        ValueError: If the body has no data URL image or it is not a supported image
+    """
+    marker = body.find(b'base64,')
+    if marker < 0 or b'"image"' not in body[:marker]:
+        raise ValueError('No image provided')
+    start = marker + len(b'base64,')
+    end = body.find(b'"', start)
+    if end < 0:
+        raise ValueError('No image provided')
+
+    view = memoryview(body)
+    try:
+        # 16 base64 characters decode to the 12 header bytes
+        if sniff_image_type(binascii.a2b_base64(view[start:start + 16])) is None:
+            raise ValueError('Uploaded data is not a supported image')
+        return binascii.a2b_base64(view[start:end])
+    except binascii.Error:
+        raise ValueError('Image is not valid base64')
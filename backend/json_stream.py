@@ -0,0 +1,108 @@
+import json
+
+
+class IncrementalArrayParser:
+    """
+    Parse the elements of a JSON array as its text arrives in chunks.
+
+    Tolerant of the ways Gemini wraps its output: anything before the first
+    "[" (prose, ```json fences) and after the closing "]" is ignored, and an
+    element that fails to parse is skipped instead of failing the whole array.
+
+    Usage:
+        parser = IncrementalArrayParser()
+        for chunk in response:
+            for element in parser.feed(chunk.text):
+                ...
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0            # Next character of the buffer to scan
+        self._started = False    # Seen the opening "["
+        self._finished = False   # Seen the closing "]"
+        self._depth = 0          # Nesting depth inside the top-level array
+        self._in_string = False
+        self._escaped = False
+        self._element_start = None
+        self.skipped = 0         # Elements that were not valid JSON
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def feed(self, text):
+        """
+        Add the next chunk of text.
+
+        Returns:
+            List of the array elements completed by this chunk
+        """
+        if self._finished or not text:
+            return []
+        self._buffer += text
+
+        elements = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+
+            if not self._started:
+                if char == '[':
+                    self._started = True
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 0:
+                    self._element_start = i
+            elif char in '{[':
+                if self._depth == 0:
+                    self._element_start = i
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0:
+                    # Closing bracket of the top-level array
+                    self._flush_scalar(buffer, i, elements)
+                    self._finished = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(buffer[self._element_start:i + 1], elements)
+                    self._element_start = None
+            elif self._depth == 0:
+                if char == ',':
+                    self._flush_scalar(buffer, i, elements)
+                elif not char.isspace() and self._element_start is None:
+                    # Start of a bare number/true/false/null element
+                    self._element_start = i
+            i += 1
+
+        # Drop the text we no longer need, keeping any partial element
+        keep_from = self._element_start if self._element_start is not None else i
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._element_start is not None:
+            self._element_start = 0
+        return elements
+
+    def _flush_scalar(self, buffer, end, elements):
+        # Strings and bare values end at the next top-level "," or "]"
+        if self._element_start is not None:
+            text = buffer[self._element_start:end].strip()
+            if text:
+                self._emit(text, elements)
+            self._element_start = None
+
+    def _emit(self, text, elements):
+        try:
+            elements.append(json.loads(text))
+        except json.JSONDecodeError:
+            self.skipped += 1
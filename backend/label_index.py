@@ -0,0 +1,286 @@
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+# Labels seen fewer times than this in past analyses are still sent to the models
+MIN_OBSERVATIONS = 2
+
+# Smallest trigram similarity (Dice coefficient) accepted for a fuzzy match.
+# Kept high: at 0.6, "plastic fork" matched "plastic cup" and "apple core"
+# matched "apple"; at 0.85 mostly plurals and spacing variants match
+MIN_SIMILARITY = 0.85
+
+# Seconds before the index is rebuilt from the database, so analyses saved by
+# other processes are picked up
+MAX_AGE = 300
+
+
+def init_label_overrides(conn):
+    """Create the admin-curated label override table."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS label_overrides (
+        label TEXT PRIMARY KEY,
+        category TEXT,
+        is_food INTEGER NOT NULL DEFAULT 0,
+        calories REAL,
+        updated_by TEXT,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+
+
+def normalize_label(label):
+    """Lowercase a label and reduce it to space-separated alphanumeric words."""
+    return " ".join(re.findall(r'[a-z0-9]+', str(label).lower()))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def load_label_overrides(conn):
+    """Return all overrides, ordered by label."""
+    cursor = conn.execute(
+        "SELECT label, category, is_food, calories, updated_by, updated_at FROM label_overrides ORDER BY label"
+    )
+    return [
+        {
+            'label': label,
+            'category': category,
+            'is_food': bool(is_food),
+            'calories': calories,
+            'updated_by': updated_by,
+            'updated_at': updated_at,
+        }
+        for label, category, is_food, calories, updated_by, updated_at in cursor
+    ]
+
+
+def save_label_override(conn, label, category=None, is_food=False, calories=None, updated_by=None):
+    """
+    Insert or replace the override for a label.
+
+    Returns:
+        The normalized label the override is stored under
+
+    Raises:
+        ValueError: If the label is empty after normalization
+    """
+    key = normalize_label(label)
+    if not key:
+        raise ValueError('label must contain letters or digits')
+    conn.execute(
+        "INSERT OR REPLACE INTO label_overrides (label, category, is_food, calories, updated_by, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        (key, (category or '').lower() or None, int(bool(is_food)), calories, updated_by)
+    )
+    conn.commit()
+    return key
+
+
+def delete_label_override(conn, label):
+    """Delete the override for a label. Returns whether one existed."""
+    cursor = conn.execute("DELETE FROM label_overrides WHERE label = ?", (normalize_label(label),))
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+class LabelIndex:
+    """
+    Maps item labels to (category, is_food, calories) learned from past tray analyses.
+
+    Entries come from the meal_items rows of previous /analyze_tray results,
+    where each label takes its most common detected (model-returned) category
+    and calorie value, and from the label_overrides table, which always wins.
+    Lookups try the normalized label first and then the closest label by
+    trigram similarity, so "Chicken Nuggets" and "chicken nugget" resolve to
+    the same entry; the returned similarity tells the two apart.
+
+    The index is built lazily and rebuilt from the database every MAX_AGE
+    seconds; analyses saved by this process are added immediately with observe().
+    """
+
+    def __init__(self, db_path, max_age=MAX_AGE, min_observations=MIN_OBSERVATIONS,
+                 min_similarity=MIN_SIMILARITY):
+        self.db_path = db_path
+        self.max_age = max_age
+        self.min_observations = min_observations
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._observations = {}   # normalized label -> {'categories', 'food', 'count', 'calories'}
+        self._overrides = {}      # normalized label -> override dict
+        self._entries = {}        # normalized label -> resolved entry
+        self._trigrams = {}       # trigram -> set of normalized labels
+
+    def lookup(self, label):
+        """
+        Resolve a label locally.
+
+        Returns:
+            Dict with label (the matched index label), category, is_food,
+            calories, count, source ("override" or "history") and similarity,
+            or None if the label is unknown
+        """
+        key = normalize_label(label)
+        if not key:
+            return None
+        self._ensure_fresh()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return dict(entry, similarity=1.0)
+
+            # Candidates share at least one trigram; score them by Dice coefficient
+            grams = trigrams(key)
+            shared = Counter()
+            for gram in grams:
+                for candidate in self._trigrams.get(gram, ()):
+                    shared[candidate] += 1
+
+            best, best_score = None, 0.0
+            for candidate, count in shared.items():
+                score = 2 * count / (len(grams) + len(trigrams(candidate)))
+                if score > best_score:
+                    best, best_score = candidate, score
+            if best is None or best_score < self.min_similarity:
+                return None
+            return dict(self._entries[best], similarity=round(best_score, 3))
+
+    def observe(self, rows):
+        """Add the meal_items rows of a newly saved tray analysis."""
+        if self._is_stale():
+            # The rebuild reads the rows that were just saved
+            self.refresh()
+            return
+        with self._lock:
+            for row in rows:
+                if row.get('detected_category'):
+                    self._add_observation(
+                        normalize_label(row['label']), row['detected_category'], row['is_food'], row.get('calories'), 1
+                    )
+
+    def refresh(self):
+        """Rebuild the index from the database."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # Only tray analyses carry a disposal category; YOLO rows from /upload
+            # don't. History is learned from the category the model returned,
+            # not the one this index resolved it to, so a wrong entry can't
+            # reinforce itself; rows saved before detected_category existed
+            # only have category
+            history = conn.execute('''
+            SELECT label, COALESCE(detected_category, category) AS learned, SUM(is_food), COUNT(*), AVG(calories)
+            FROM meal_items
+            WHERE learned IS NOT NULL
+            GROUP BY label, learned
+            ''').fetchall()
+            overrides = load_label_overrides(conn)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._observations = {}
+            for label, category, food_count, count, calories in history:
+                key = normalize_label(label)
+                if key:
+                    self._add_observation(key, category, food_count * 2 >= count, calories, count, rebuild=False)
+            self._overrides = {override['label']: override for override in overrides}
+            self._rebuild()
+            self._built_at = time.monotonic()
+
+    def stats(self):
+        self._ensure_fresh()
+        with self._lock:
+            return {
+                'labels': len(self._entries),
+                'overrides': len(self._overrides),
+                'observed_labels': len(self._observations),
+                'trigrams': len(self._trigrams),
+            }
+
+    def _is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.max_age
+
+    def _ensure_fresh(self):
+        if self._is_stale():
+            self.refresh()
+
+    def _add_observation(self, key, category, is_food, calories, count, rebuild=True):
+        observation = self._observations.setdefault(
+            key, {'categories': Counter(), 'food': 0, 'count': 0, 'calories': []}
+        )
+        observation['categories'][category.lower()] += count
+        observation['food'] += count if is_food else 0
+        observation['count'] += count
+        if calories is not None:
+            observation['calories'].append((calories, count))
+        if rebuild:
+            self._set_entry(key, self._resolve(key))
+
+    def _resolve(self, key):
+        override = self._overrides.get(key)
+        if override is not None:
+            return {
+                'label': key,
+                'category': override['category'],
+                'is_food': override['is_food'],
+                'calories': override['calories'],
+                'count': self._observations.get(key, {}).get('count', 0),
+                'source': 'override',
+            }
+
+        observation = self._observations.get(key)
+        if observation is None or observation['count'] < self.min_observations:
+            return None
+        weighted = observation['calories']
+        calories = None
+        if weighted:
+            calories = sum(value * count for value, count in weighted) / sum(count for _, count in weighted)
+        return {
+            'label': key,
+            'category': observation['categories'].most_common(1)[0][0],
+            'is_food': observation['food'] * 2 >= observation['count'],
+            'calories': calories,
+            'count': observation['count'],
+            'source': 'history',
+        }
+
+    def _rebuild(self):
+        self._entries = {}
+        self._trigrams = defaultdict(set)
+        for key in set(self._observations) | set(self._overrides):
+            self._set_entry(key, self._resolve(key))
+
+    def _set_entry(self, key, entry):
+        if entry is None:
+            return
+        if key not in self._entries:
+            for gram in trigrams(key):
+                self._trigrams.setdefault(gram, set()).add(key)
+        self._entries[key] = entry
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Look up item labels in the local label index")
+    parser.add_argument('labels', nargs='*', help="Labels to look up")
+    parser.add_argument('--db', default=os.getenv(
+        'MEAL_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meal_history.db')
+    ))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    init_label_overrides(conn)
+    conn.close()
+
+    index = LabelIndex(args.db)
+    print(index.stats())
+    for label in args.labels:
+        print(f"{label}: {index.lookup(label)}")
@@ -0,0 +1,363 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+
+from detection import CONFIDENCE_THRESHOLD, MODEL_LOCK, extract_detections, draw_detections
+from metrics import timer
+
+# Camera lanes as comma-separated name=source[@fps] entries, where source is a
+# capture device index or a video file path (video files loop, for testing),
+# e.g. "belt1=0@15,belt2=1,demo=videos/trays.mp4@5"
+CAMERA_LANES = os.getenv('CAMERA_LANES', 'default=0')
+
+# Target detections per second for lanes that don't set their own
+DEFAULT_LANE_FPS = float(os.getenv('LANE_FPS', 10))
+
+# "round_robin" runs one frame per inference; "batch" runs up to LANE_BATCH_SIZE
+# due lanes through the model together
+LANE_SCHEDULER = os.getenv('LANE_SCHEDULER', 'round_robin')
+LANE_BATCH_SIZE = int(os.getenv('LANE_BATCH_SIZE', 4))
+
+# How far (seconds) a lane's schedule may fall behind when the detector can't
+# keep up; all lanes lag together, so each slows down in proportion to its target
+MAX_SCHEDULE_LAG = 1.0
+
+# Seconds a lane keeps its camera open after the last viewer leaves
+LANE_IDLE_TIMEOUT = float(os.getenv('LANE_IDLE_TIMEOUT', 10))
+
+
+def parse_lanes(spec):
+    """
+    Parse a CAMERA_LANES string.
+
+    Returns:
+        List of (name, source, fps) where source is an int device index or a path
+
+    Raises:
+        ValueError: If an entry is malformed or a name repeats
+    """
+    lanes = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, source = entry.partition('=')
+        if not sep or not name.strip() or not source.strip():
+            raise ValueError(f"Invalid lane '{entry}' (expected name=source[@fps])")
+
+        fps = DEFAULT_LANE_FPS
+        source, at, fps_text = source.strip().rpartition('@') if '@' in source else (source.strip(), '', '')
+        if at:
+            fps = float(fps_text)
+        source = int(source) if source.isdigit() else source
+
+        name = name.strip()
+        if any(existing == name for existing, _, _ in lanes):
+            raise ValueError(f"Duplicate lane name '{name}'")
+        lanes.append((name, source, fps))
+    return lanes
+
+
+class Lane:
+    """
+    One camera lane: a capture thread that keeps only the newest frame, and
+    the newest annotated JPEG produced for it by the scheduler.
+    """
+
+    def __init__(self, name, source, target_fps):
+        self.name = name
+        self.source = source
+        self.target_fps = target_fps
+        self.interval = 1.0 / target_fps if target_fps > 0 else 0.0
+
+        self._lock = threading.Lock()
+        self._published = threading.Condition(self._lock)
+        self._thread = None
+        self._frame = None
+        self._frame_seq = 0
+        self._processed_seq = 0
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._viewers = 0
+        self._last_viewer_at = 0.0
+        self._closed = False
+        self._observers = []
+
+        # When the scheduler next owes this lane a detection
+        self.next_due = 0.0
+
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self._processed_times = []
+
+    def attach(self, on_frame):
+        """Register a viewer, starting the capture thread if needed."""
+        with self._lock:
+            self._viewers += 1
+            self._last_viewer_at = time.monotonic()
+            if self._viewers == 1:
+                # Start the schedule afresh rather than owing detections from before
+                self.next_due = self._last_viewer_at
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(
+                    target=self._capture, args=(on_frame,), name=f"lane-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def detach(self):
+        with self._lock:
+            self._viewers -= 1
+            self._last_viewer_at = time.monotonic()
+
+    @property
+    def active(self):
+        return self._viewers > 0
+
+    def take_frame(self):
+        """
+        Return the newest frame not yet processed, or None.
+
+        Frames that arrived while the previous one was being processed are
+        counted as skipped; only the newest is worth detecting on.
+        """
+        with self._lock:
+            if self._frame is None or self._frame_seq == self._processed_seq:
+                return None
+            self.frames_skipped += self._frame_seq - self._processed_seq - 1
+            self._processed_seq = self._frame_seq
+            return self._frame
+
+    def has_new_frame(self):
+        return self._frame_seq != self._processed_seq
+
+    def add_observer(self, callback):
+        with self._lock:
+            self._observers.append(callback)
+
+    def remove_observer(self, callback):
+        with self._lock:
+            self._observers.remove(callback)
+
+    def notify(self, frame, detections):
+        """Pass a processed frame and its detections to the lane's observers."""
+        with self._lock:
+            observers = list(self._observers)
+        for callback in observers:
+            callback(frame, detections)
+
+    def publish(self, jpeg):
+        """Store an annotated frame and wake the lane's viewers."""
+        now = time.monotonic()
+        with self._lock:
+            self._jpeg = jpeg
+            self._jpeg_seq += 1
+            self.frames_processed += 1
+            self._processed_times.append(now)
+            # Keep a few seconds of history for the achieved FPS
+            while self._processed_times and now - self._processed_times[0] > 5.0:
+                self._processed_times.pop(0)
+            self._published.notify_all()
+
+    def stream(self, on_frame):
+        """
+        Yield annotated frames as multipart MJPEG parts for one viewer.
+
+        Ends when the capture stops (device unavailable); a viewer that falls
+        behind only ever receives the newest frame.
+        """
+        self.attach(on_frame)
+        try:
+            seen = 0
+            while True:
+                with self._lock:
+                    while self._jpeg_seq == seen and not self._closed:
+                        self._published.wait(timeout=1.0)
+                    if self._jpeg_seq == seen and self._closed:
+                        return
+                    seen, jpeg = self._jpeg_seq, self._jpeg
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            self.detach()
+
+    def stats(self):
+        with self._lock:
+            times = self._processed_times
+            achieved = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+            return {
+                'lane': self.name,
+                'source': self.source,
+                'target_fps': self.target_fps,
+                'achieved_fps': round(achieved, 2),
+                'viewers': self._viewers,
+                'capturing': self._thread is not None and self._thread.is_alive(),
+                'frames_captured': self.frames_captured,
+                'frames_processed': self.frames_processed,
+                'frames_skipped': self.frames_skipped,
+            }
+
+    def _capture(self, on_frame):
+        cap = cv2.VideoCapture(self.source)
+        is_file = isinstance(self.source, str)
+        # Video files are paced at their own frame rate instead of decoding flat out
+        file_interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0) if is_file else 0.0
+        try:
+            while True:
+                with self._lock:
+                    idle = self._viewers <= 0 and time.monotonic() - self._last_viewer_at > LANE_IDLE_TIMEOUT
+                if idle:
+                    break
+
+                started = time.monotonic()
+                success, frame = cap.read()
+                if not success and is_file and self.frames_captured:
+                    # Loop the file
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    success, frame = cap.read()
+                if not success:
+                    print(f"Lane {self.name}: could not read from {self.source!r}")
+                    break
+
+                with self._lock:
+                    self._frame = frame
+                    self._frame_seq += 1
+                    self.frames_captured += 1
+                on_frame()
+
+                if file_interval:
+                    time.sleep(max(0.0, file_interval - (time.monotonic() - started)))
+        finally:
+            cap.release()
+            with self._lock:
+                self._closed = True
+                self._frame = None
+                # The last frame is gone, so it must not count as pending
+                self._processed_seq = self._frame_seq
+                self._published.notify_all()
+
+
+class LaneScheduler:
+    """
+    Runs the frames of every camera lane through a single detector.
+
+    A single thread picks the lanes whose next detection is due, earliest
+    deadline first, so every lane gets its target FPS when the detector keeps
+    up and they all slow down in proportion when it doesn't. In "batch" mode up to
+    batch_size due lanes share one model call.
+
+    Usage:
+        scheduler = LaneScheduler(model, parse_lanes(CAMERA_LANES))
+        Response(scheduler.stream('belt1'), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """
+
+    def __init__(self, model, lanes, mode=LANE_SCHEDULER, batch_size=LANE_BATCH_SIZE):
+        if mode not in ('round_robin', 'batch'):
+            raise ValueError('mode must be "round_robin" or "batch"')
+        self.model = model
+        self.lanes = {name: Lane(name, source, fps) for name, source, fps in lanes}
+        self.mode = mode
+        self.batch_size = batch_size if mode == 'batch' else 1
+        self._frame_ready = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def default_lane(self):
+        return next(iter(self.lanes))
+
+    def stream(self, lane_name):
+        """
+        MJPEG generator for one lane.
+
+        Raises:
+            KeyError: If the lane is not configured
+        """
+        lane = self.lanes[lane_name]
+        self._ensure_running()
+        return lane.stream(self._frame_ready.set)
+
+    @contextmanager
+    def observe(self, lane_name, callback):
+        """
+        Call callback(frame, detections) for every frame the lane processes
+        while the block runs; the observer counts as a viewer of the lane.
+
+        Callbacks run on the scheduler thread and must return quickly.
+
+        Raises:
+            KeyError: If the lane is not configured
+        """
+        lane = self.lanes[lane_name]
+        self._ensure_running()
+        lane.attach(self._frame_ready.set)
+        lane.add_observer(callback)
+        try:
+            yield lane
+        finally:
+            lane.remove_observer(callback)
+            lane.detach()
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'batch_size': self.batch_size,
+            'lanes': [lane.stats() for lane in self.lanes.values()],
+        }
+
+    def _ensure_running(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='lane-scheduler', daemon=True)
+                self._thread.start()
+
+    def _due_lanes(self, now):
+        due = [
+            lane for lane in self.lanes.values()
+            if lane.active and lane.has_new_frame() and lane.next_due <= now
+        ]
+        due.sort(key=lambda lane: lane.next_due)
+        return due[:self.batch_size]
+
+    def _run(self):
+        while True:
+            self._frame_ready.clear()
+            now = time.monotonic()
+            due = self._due_lanes(now)
+            if not due:
+                # Sleep until a new frame arrives or the next lane falls due
+                pending = [lane.next_due for lane in self.lanes.values() if lane.active and lane.has_new_frame()]
+                timeout = max(0.001, min(pending) - now) if pending else 0.5
+                self._frame_ready.wait(timeout)
+                continue
+
+            taken = []
+            for lane in due:
+                frame = lane.take_frame()
+                if frame is not None:
+                    taken.append((lane, frame))
+            if not taken:
+                # The lanes' frames went away (capture stopped); wait for new ones
+                self._frame_ready.wait(0.5)
+                continue
+
+            try:
+                with timer('lane_inference'), MODEL_LOCK:
+                    results = self.model([frame for _, frame in taken], conf=CONFIDENCE_THRESHOLD, verbose=False)
+            except Exception as e:
+                print(f"Lane scheduler inference failed: {e}")
+                time.sleep(0.1)
+                continue
+
+            for (lane, frame), result in zip(taken, results):
+                # Deadlines advance from the previous one so lanes keep their
+                # rate; a lane that was idle doesn't bank more than MAX_SCHEDULE_LAG
+                lane.next_due = max(lane.next_due + lane.interval, now - MAX_SCHEDULE_LAG)
+                detections = extract_detections(result)
+                lane.notify(frame, detections)
+                _, buffer = cv2.imencode('.jpg', draw_detections(frame, detections))
+                lane.publish(buffer.tobytes())
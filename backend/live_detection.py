@@ -0,0 +1,115 @@
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detection import CONFIDENCE_THRESHOLD, MODEL_LOCK, extract_detections
+from image_ingest import MODEL_IMAGE_SIZE, resize_to_fit, scale_detections
+from image_upload import sniff_image_type
+from metrics import STAGE_DURATION
+
+# Largest frame accepted over the detection WebSocket; the connection is
+# closed (status 1009) if a client sends more
+MAX_FRAME_BYTES = int(os.getenv('WS_MAX_FRAME_BYTES', 2 * 1024 * 1024))
+
+
+def detect_frame(model, data):
+    """
+    Run YOLO on one compressed frame.
+
+    Args:
+        model: YOLO model
+        data: JPEG/PNG/WebP/BMP bytes
+
+    Returns:
+        Tuple of (detections, (width, height), timings in ms); boxes are in
+        the coordinates of the frame as sent
+
+    Raises:
+        ValueError: If the data is not a supported image
+    """
+    start = time.perf_counter()
+    if sniff_image_type(data[:12]) is None:
+        raise ValueError('Frame is not a supported image')
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError('Frame could not be decoded')
+    image, scale = resize_to_fit(frame, MODEL_IMAGE_SIZE)
+    decoded = time.perf_counter()
+
+    with MODEL_LOCK:
+        results = model(image, conf=CONFIDENCE_THRESHOLD, verbose=False)
+    detections = scale_detections(extract_detections(results[0]), scale)
+    inferred = time.perf_counter()
+
+    # Observed directly: a socket lives for many frames, so the per-request
+    # stage list that timer() appends to would grow without bound
+    STAGE_DURATION.observe('ws_decode', decoded - start)
+    STAGE_DURATION.observe('yolo_inference', inferred - decoded)
+
+    height, width = frame.shape[:2]
+    return detections, (width, height), {
+        'decode_ms': round((decoded - start) * 1000, 2),
+        'inference_ms': round((inferred - decoded) * 1000, 2),
+    }
+
+
+def serve_detection_socket(ws, model):
+    """
+    Answer compressed frames from a client with detection JSON until it disconnects.
+
+    Each binary message is one frame. Frames that arrive while a detection is
+    running are dropped in favour of the newest, so a client sending faster
+    than the server can detect gets fresh results rather than a growing
+    backlog. Each reply reports how many frames were dropped before it:
+
+        {"frame": 12, "width": 640, "height": 480,
+         "detections": [{"class": "cup", "confidence": 0.81, "box": [x1, y1, x2, y2]}],
+         "dropped": 3, "timing": {"decode_ms": .., "inference_ms": .., "server_ms": ..}}
+
+    "frame" counts the binary messages received on this socket, starting at 1.
+    A frame that isn't a valid image gets {"frame": n, "error": "..."}.
+
+    Args:
+        ws: simple_websocket/flask-sock connection
+        model: YOLO model
+    """
+    received = 0
+    while True:
+        message = ws.receive()
+        if message is None:
+            return
+        received_at = time.perf_counter()
+        received += 1
+
+        # Skip to the newest frame the client has already sent
+        dropped = 0
+        while True:
+            newer = ws.receive(timeout=0)
+            if newer is None:
+                break
+            message, received_at = newer, time.perf_counter()
+            received += 1
+            dropped += 1
+
+        if not isinstance(message, (bytes, bytearray)):
+            ws.send(json.dumps({'frame': received, 'error': 'Frames must be sent as binary messages'}))
+            continue
+
+        try:
+            detections, (width, height), timing = detect_frame(model, bytes(message))
+        except ValueError as e:
+            ws.send(json.dumps({'frame': received, 'error': str(e), 'dropped': dropped}))
+            continue
+
+        timing['server_ms'] = round((time.perf_counter() - received_at) * 1000, 2)
+        ws.send(json.dumps({
+            'frame': received,
+            'width': width,
+            'height': height,
+            'detections': detections,
+            'dropped': dropped,
+            'timing': timing,
+        }))
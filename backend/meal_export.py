@@ -0,0 +1,194 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+
+from meal_store import get_meal_items
+
+# Meals read (and items loaded) per query
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = [
+    'meal_id', 'user_id', 'meal_date', 'tray_score', 'total_calories',
+    'label', 'category', 'is_food', 'confidence', 'calories',
+]
+
+
+def parse_date_bound(value, end=False):
+    """
+    Parse an ISO date or datetime used as an export bound.
+
+    A plain date as the end bound includes that whole day.
+
+    Returns:
+        ISO string, or None if value is empty
+
+    Raises:
+        ValueError: If value is not an ISO date/datetime
+    """
+    if not value:
+        return None
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        return (day + timedelta(days=1) if end else day).isoformat()
+    return datetime.fromisoformat(value).isoformat()
+
+
+def iter_meal_chunks(conn, start=None, end=None, user_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield meals with their items, chunk_size meals at a time, in id order.
+
+    Each chunk is a separate short query continuing after the last id seen,
+    so no read transaction stays open while the caller writes the chunk out
+    and meals saved meanwhile are not blocked. Meal images are not exported.
+
+    Args:
+        conn: SQLite connection
+        start: ISO lower bound on meal_date (inclusive), or None
+        end: ISO upper bound on meal_date (exclusive), or None
+        user_id: Restrict to one user's meals if given
+        chunk_size: Meals per chunk
+
+    Yields:
+        Lists of meal dicts with an "items" list each
+    """
+    # julianday() accepts both the "T" and space separated timestamps stored in meals
+    query = 'SELECT id, user_id, meal_date, tray_score, total_calories FROM meals WHERE id > ?'
+    params = []
+    if start is not None:
+        query += ' AND julianday(meal_date) >= julianday(?)'
+        params.append(start)
+    if end is not None:
+        query += ' AND julianday(meal_date) < julianday(?)'
+        params.append(end)
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    query += ' ORDER BY id LIMIT ?'
+
+    last_id = 0
+    while True:
+        rows = conn.execute(query, [last_id, *params, chunk_size]).fetchall()
+        if not rows:
+            return
+        items_by_meal = get_meal_items(conn, [row[0] for row in rows])
+        yield [
+            {
+                'meal_id': meal_id,
+                'user_id': user_id_,
+                'meal_date': meal_date,
+                'tray_score': tray_score,
+                'total_calories': total_calories,
+                'items': items_by_meal[meal_id],
+            }
+            for meal_id, user_id_, meal_date, tray_score, total_calories in rows
+        ]
+        last_id = rows[-1][0]
+
+
+def format_ndjson(chunks):
+    """One JSON object per meal, with its items nested."""
+    for meals in chunks:
+        yield ''.join(json.dumps(meal) + '\n' for meal in meals)
+
+
+def format_csv(chunks):
+    """One row per item; meals without items get a single row with empty item columns."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for meals in chunks:
+        for meal in meals:
+            meal_columns = [meal['meal_id'], meal['user_id'], meal['meal_date'], meal['tray_score'],
+                            meal['total_calories']]
+            for item in meal['items'] or [None]:
+                if item is None:
+                    writer.writerow(meal_columns + [''] * 5)
+                else:
+                    writer.writerow(meal_columns + [
+                        item['label'], item['category'], int(item['is_food']), item['confidence'],
+                        item['calories'],
+                    ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_stream(text_chunks, compress=False):
+    """UTF-8 encode text chunks, gzip-compressing them on the fly if compress is set."""
+    if not compress:
+        for text in text_chunks:
+            yield text.encode('utf-8')
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for text in text_chunks:
+        data = compressor.compress(text.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_meals(db_path, fmt='ndjson', start=None, end=None, user_id=None, compress=False,
+                 chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Stream meal history as NDJSON or CSV bytes.
+
+    Only one chunk of meals is held in memory at a time, whatever the size
+    of the meals table. The connection is closed when the generator finishes
+    or is closed.
+
+    Raises:
+        ValueError: If fmt is not a known export format
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    formatter = format_ndjson if fmt == 'ndjson' else format_csv
+
+    def generate():
+        conn = sqlite3.connect(db_path)
+        try:
+            chunks = iter_meal_chunks(conn, start, end, user_id, chunk_size)
+            yield from encode_stream(formatter(chunks), compress)
+        finally:
+            conn.close()
+
+    return generate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export meal history as NDJSON or CSV")
+    parser.add_argument('--db', default=os.getenv(
+        'MEAL_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meal_history.db')
+    ))
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+    parser.add_argument('--start', help="First date (YYYY-MM-DD or ISO datetime)")
+    parser.add_argument('--end', help="Last date, inclusive (YYYY-MM-DD), or exclusive ISO datetime")
+    parser.add_argument('--user', help="Only export this user's meals")
+    parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip")
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument('--output', '-o', help="Output file (defaults to stdout)")
+    args = parser.parse_args()
+
+    try:
+        start, end = parse_date_bound(args.start), parse_date_bound(args.end, end=True)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for data in export_meals(args.db, args.format, start, end, args.user, args.gzip, args.chunk_size):
+            out.write(data)
+    finally:
+        if args.output:
+            out.close()
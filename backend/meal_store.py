@@ -0,0 +1,275 @@
+import json
+import sqlite3
+
+# Schema version stored in PRAGMA user_version once the meal_items backfill has run
+MEAL_ITEMS_SCHEMA_VERSION = 1
+
+
+def connect_meal_db(db_path, **kwargs):
+    """
+    Open the meal database with foreign keys enforced.
+
+    SQLite only honours REFERENCES ... ON DELETE CASCADE on connections that
+    enable foreign keys, so every connection to the meal database goes
+    through here; deleting a meal then removes its items and thumbnail.
+    """
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+
+def delete_meal(conn, meal_id):
+    """Delete a meal along with its items. Returns whether the meal existed."""
+    cursor = conn.execute('DELETE FROM meals WHERE id = ?', (meal_id,))
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def init_meals(conn):
+    """Create the meals table."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS meals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        meal_date TIMESTAMP NOT NULL,
+        meal_image TEXT NOT NULL,
+        meal_items TEXT NOT NULL,
+        tray_score REAL,
+        total_calories INTEGER
+    )
+    ''')
+    conn.commit()
+
+
+def init_meal_items(conn):
+    """Create the normalized meal_items table and backfill it from the legacy JSON column."""
+    cursor = conn.cursor()
+
+    # One row per detected item; box is kept in the detector's native format
+    # (YOLO: [x1, y1, x2, y2] pixels of the stored meal image, Gemini:
+    # [y1, x1, y2, x2] normalized 0-1000). detected_category is the category
+    # the model returned, before the label index replaced it in category
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS meal_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meal_id INTEGER NOT NULL REFERENCES meals(id) ON DELETE CASCADE,
+        label TEXT NOT NULL,
+        category TEXT,
+        detected_category TEXT,
+        is_food INTEGER NOT NULL DEFAULT 0,
+        confidence REAL,
+        box TEXT,
+        calories REAL
+    )
+    ''')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(meal_items)')}
+    if 'detected_category' not in columns:
+        cursor.execute('ALTER TABLE meal_items ADD COLUMN detected_category TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_items_meal_id ON meal_items (meal_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_items_label ON meal_items (label)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_items_category ON meal_items (category)')
+
+    # Items of meals deleted before foreign keys were enforced
+    cursor.execute('DELETE FROM meal_items WHERE meal_id NOT IN (SELECT id FROM meals)')
+
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version < MEAL_ITEMS_SCHEMA_VERSION:
+        backfill_meal_items(conn)
+        cursor.execute(f'PRAGMA user_version = {MEAL_ITEMS_SCHEMA_VERSION}')
+    conn.commit()
+
+
+def backfill_meal_items(conn):
+    """
+    Populate meal_items from the JSON stored in meals.meal_items.
+
+    Meals that already have normalized rows are skipped, so the migration
+    can safely be re-run.
+
+    Returns:
+        Number of item rows inserted
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, meal_items FROM meals
+    WHERE NOT EXISTS (SELECT 1 FROM meal_items WHERE meal_items.meal_id = meals.id)
+    ''')
+
+    inserted = 0
+    for meal_id, raw_items in cursor.fetchall():
+        try:
+            items = json.loads(raw_items) if raw_items else []
+        except json.JSONDecodeError:
+            print(f"Skipping meal {meal_id}: meal_items is not valid JSON")
+            continue
+        if not isinstance(items, list):
+            continue
+        inserted += insert_meal_items(conn, meal_id, normalize_items(items))
+    return inserted
+
+
+def normalize_items(items, food_items=None):
+    """
+    Convert the per-route item shapes into meal_items rows.
+
+    Handles YOLO detections ({class, confidence, box}), Gemini tray items
+    ({label, category, box_2d}), processed food items ({name, calories})
+    and bare strings.
+
+    Args:
+        items: List of detected items in any of the shapes above
+        food_items: Optional list of {name, calories} dicts used to mark
+            matching labels as food and attach their calories
+
+    Returns:
+        List of dicts with label, category, detected_category, is_food,
+        confidence, box and calories
+    """
+    # Gemini errors come back as {"error": ...} rather than a list
+    if not isinstance(items, list):
+        items = []
+
+    calories_by_name = {}
+    for food in food_items or []:
+        calories_by_name[food['name'].lower()] = _calorie_value(food.get('calories'))
+
+    rows = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'label': item}
+        if not isinstance(item, dict):
+            continue
+
+        label = item.get('label') or item.get('name') or item.get('class')
+        if not label:
+            continue
+
+        box = item.get('box_2d', item.get('box'))
+        is_food = 'name' in item or label.lower() in calories_by_name
+        calories = _calorie_value(item.get('calories'))
+        if calories is None:
+            calories = calories_by_name.get(label.lower())
+
+        # Items whose category the label index replaced keep the original
+        detected_category = item['detected_category'] if 'detected_category' in item else item.get('category')
+        rows.append({
+            'label': label,
+            'category': (item.get('category') or '').lower() or None,
+            'detected_category': (detected_category or '').lower() or None,
+            'is_food': is_food,
+            'confidence': item.get('confidence'),
+            'box': box,
+            'calories': calories,
+        })
+
+    # Food items Gemini named that don't match any detected label still get a row
+    labels = {row['label'].lower() for row in rows}
+    for food in food_items or []:
+        if food['name'].lower() not in labels:
+            rows.append({
+                'label': food['name'],
+                'category': None,
+                'detected_category': None,
+                'is_food': True,
+                'confidence': None,
+                'box': None,
+                'calories': _calorie_value(food.get('calories')),
+            })
+    return rows
+
+
+def _calorie_value(calories):
+    # Calories are stored either as the USDA info dict or as a plain number
+    if isinstance(calories, dict):
+        return calories.get('calories')
+    if isinstance(calories, (int, float)):
+        return calories
+    return None
+
+
+def insert_meal_items(conn, meal_id, rows):
+    """Insert normalized item rows for a meal. Returns the number of rows inserted."""
+    conn.executemany(
+        "INSERT INTO meal_items (meal_id, label, category, detected_category, is_food, confidence, box, calories) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                meal_id,
+                row['label'],
+                row['category'],
+                row['detected_category'],
+                int(bool(row['is_food'])),
+                row['confidence'],
+                json.dumps(row['box']) if row['box'] is not None else None,
+                row['calories'],
+            )
+            for row in rows
+        ]
+    )
+    return len(rows)
+
+
+def get_meal_items(conn, meal_ids):
+    """
+    Load normalized items for a set of meals.
+
+    Returns:
+        Dict mapping meal_id to a list of item dicts, in insertion order
+    """
+    items_by_meal = {meal_id: [] for meal_id in meal_ids}
+    if not items_by_meal:
+        return items_by_meal
+
+    placeholders = ", ".join("?" for _ in items_by_meal)
+    cursor = conn.execute(
+        f"SELECT meal_id, label, category, is_food, confidence, box, calories FROM meal_items "
+        f"WHERE meal_id IN ({placeholders}) ORDER BY id",
+        list(items_by_meal)
+    )
+    for meal_id, label, category, is_food, confidence, box, calories in cursor:
+        items_by_meal[meal_id].append({
+            'label': label,
+            'category': category,
+            'is_food': bool(is_food),
+            'confidence': confidence,
+            'box': json.loads(box) if box else None,
+            'calories': calories,
+        })
+    return items_by_meal
+
+
+def top_disposed_items(conn, since, user_id=None, category=None, limit=10):
+    """
+    Most frequently scanned item labels since a given time.
+
+    Args:
+        conn: SQLite connection
+        since: datetime (or ISO string) lower bound on meal_date
+        user_id: Restrict to one user's meals if given
+        category: Restrict to one disposal category if given
+        limit: Maximum number of labels to return
+
+    Returns:
+        List of dicts with label, category and count, most frequent first
+    """
+    # julianday() accepts both the "T" and space separated timestamps stored in meals
+    query = '''
+    SELECT mi.label, mi.category, COUNT(*) AS count
+    FROM meal_items mi
+    JOIN meals m ON m.id = mi.meal_id
+    WHERE julianday(m.meal_date) >= julianday(?)
+    '''
+    params = [since.isoformat() if hasattr(since, 'isoformat') else since]
+    if user_id is not None:
+        query += ' AND m.user_id = ?'
+        params.append(user_id)
+    if category is not None:
+        query += ' AND mi.category = ?'
+        params.append(category.lower())
+    query += ' GROUP BY mi.label, mi.category ORDER BY count DESC, mi.label LIMIT ?'
+    params.append(limit)
+
+    return [
+        {'label': label, 'category': cat, 'count': count}
+        for label, cat, count in conn.execute(query, params)
+    ]
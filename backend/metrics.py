@@ -0,0 +1,162 @@
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, has_request_context, request
+
+# Histogram bucket upper bounds in seconds (Gemini calls can take several seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Accepted format for client-supplied X-Request-ID headers
+REQUEST_ID_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+# Per-request timing lines are written as JSON to this logger
+timing_logger = logging.getLogger('trayce.timing')
+if not timing_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    timing_logger.addHandler(_handler)
+    timing_logger.setLevel(logging.INFO)
+    timing_logger.propagate = False
+
+
+class Histogram:
+    """A Prometheus-style histogram with one series per label value."""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += seconds
+            series['count'] += 1
+
+    def render(self):
+        """Return the histogram in the Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{_escape(label_value)}"'
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{label}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{label}}} {series["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_DURATION = Histogram(
+    'trayce_stage_duration_seconds', 'Time spent in each processing stage', 'stage'
+)
+REQUEST_DURATION = Histogram(
+    'trayce_request_duration_seconds', 'Total request handling time per endpoint', 'endpoint'
+)
+
+
+def record(stage, seconds):
+    """
+    Record a stage duration measured by the caller.
+
+    For stages that don't map onto a single block of code, such as the time
+    to the first item of a streamed response.
+    """
+    STAGE_DURATION.observe(stage, seconds)
+    if has_request_context() and hasattr(g, 'stage_timings'):
+        g.stage_timings.append((stage, seconds))
+
+
+@contextmanager
+def timer(stage):
+    """
+    Time a block of code as a named stage.
+
+    The duration is added to the stage histogram and, inside a Flask request,
+    to that request's timing log.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator form of timer()."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            with timer(stage):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def current_request_id():
+    """The id of the current request, or None outside a request."""
+    if has_request_context():
+        return getattr(g, 'request_id', None)
+    return None
+
+
+def init_app(app):
+    """Register the request id/timing hooks and the /metrics endpoint on a Flask app."""
+
+    @app.before_request
+    def start_request_timer():
+        # Client-supplied ids are reused (in logs and profile summaries) only if they are safe
+        request_id = request.headers.get('X-Request-ID', '')
+        g.request_id = request_id if REQUEST_ID_RE.fullmatch(request_id) else uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+        g.stage_timings = []
+
+    @app.after_request
+    def log_request_timings(response):
+        if not hasattr(g, 'request_start'):
+            return response
+
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_DURATION.observe(endpoint, elapsed)
+        response.headers['X-Request-ID'] = g.request_id
+
+        # Streaming responses (e.g. /video_feed) are logged when the headers go out
+        if endpoint != 'metrics':
+            timing_logger.info(json.dumps({
+                'request_id': g.request_id,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(elapsed * 1000, 2),
+                'stages': [
+                    {'stage': stage, 'ms': round(seconds * 1000, 2)}
+                    for stage, seconds in g.stage_timings
+                ],
+            }))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(
+            STAGE_DURATION.render() + REQUEST_DURATION.render(),
+            mimetype='text/plain; version=0.0.4'
+        )
@@ -0,0 +1,297 @@
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from flask import g, request, session
+
+# Where per-request profiles are written, one set of files per profile id
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+
+# Profiles kept in PROFILE_DIR, and their total size in bytes; past either,
+# the oldest profiles are deleted as new ones are written
+PROFILE_MAX_COUNT = int(os.getenv('PROFILE_MAX_COUNT', 500))
+PROFILE_MAX_BYTES = int(os.getenv('PROFILE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Endpoints that are never sampled (long-lived streams would hold the profiler open)
+EXCLUDED_ENDPOINTS = {'metrics', 'static', 'profiling_settings', 'list_profiles', 'download_profile', 'detect_socket'}
+
+# Runtime settings, changed by admins through /admin/profiling
+settings = {
+    'sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', 0.0)),
+    'mode': os.getenv('PROFILE_MODE', 'sampling'),  # "sampling" or "cprofile"
+    'trace_memory': os.getenv('PROFILE_TRACE_MEMORY') == '1',
+    'interval': float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005)),
+}
+_settings_lock = threading.Lock()
+
+# Forced requests currently tracing memory; tracemalloc runs only while there are any
+_traced_requests = 0
+_tracing_lock = threading.Lock()
+
+_prune_lock = threading.Lock()
+
+
+def update_settings(**changes):
+    """Validate and apply new profiling settings. Returns the current settings."""
+    with _settings_lock:
+        if 'sample_rate' in changes:
+            rate = float(changes['sample_rate'])
+            if not 0.0 <= rate <= 1.0:
+                raise ValueError('sample_rate must be between 0 and 1')
+            settings['sample_rate'] = rate
+        if 'mode' in changes:
+            if changes['mode'] not in ('sampling', 'cprofile'):
+                raise ValueError('mode must be "sampling" or "cprofile"')
+            settings['mode'] = changes['mode']
+        if 'interval' in changes:
+            settings['interval'] = max(0.001, float(changes['interval']))
+        if 'trace_memory' in changes:
+            settings['trace_memory'] = bool(changes['trace_memory'])
+        return dict(settings)
+
+
+def _start_tracing():
+    # tracemalloc slows every allocation in the process, so it only runs
+    # while a forced request wants a memory profile
+    global _traced_requests
+    with _tracing_lock:
+        if _traced_requests == 0:
+            tracemalloc.start()
+        _traced_requests += 1
+    return tracemalloc.take_snapshot()
+
+
+def _stop_tracing():
+    global _traced_requests
+    with _tracing_lock:
+        _traced_requests -= 1
+        if _traced_requests == 0:
+            tracemalloc.stop()
+
+
+def _new_profile_id():
+    # Creation time (UTC) first, so profile ids sort by age
+    now = time.time()
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{int(now % 1 * 1000):03d}-{uuid.uuid4().hex[:8]}"
+
+
+def prune_profiles(max_count=PROFILE_MAX_COUNT, max_bytes=PROFILE_MAX_BYTES):
+    """
+    Delete the oldest profiles until at most max_count profiles totalling at
+    most max_bytes remain.
+
+    Returns:
+        Number of profiles deleted
+    """
+    with _prune_lock:
+        profiles = {}
+        for entry in os.scandir(PROFILE_DIR):
+            try:
+                size = entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            profile_id = os.path.splitext(entry.name)[0]
+            profiles.setdefault(profile_id, []).append((entry.path, size))
+
+        # Profile ids start with their creation time, so name order is age order
+        total = sum(size for files in profiles.values() for _, size in files)
+        count = len(profiles)
+        deleted = 0
+        for profile_id in sorted(profiles):
+            if count <= max_count and total <= max_bytes:
+                break
+            for path, size in profiles[profile_id]:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            count -= 1
+            deleted += 1
+        return deleted
+
+
+class StackSampler:
+    """
+    A low-overhead sampling profiler for selected threads.
+
+    A single background thread wakes every `interval` seconds and records the
+    current stack of each registered thread as a folded stack string, the
+    format flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self):
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def register(self, thread_id):
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unregister(self, thread_id):
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                thread_ids = list(self._stacks)
+            if not thread_ids:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = _fold(frame)
+                with self._lock:
+                    if thread_id in self._stacks:
+                        self._stacks[thread_id][stack] += 1
+            time.sleep(settings['interval'])
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+sampler = StackSampler()
+
+
+def init_app(app, is_admin):
+    """
+    Register hooks that profile a random sample of requests.
+
+    Requests are sampled at settings['sample_rate']; admins can force a
+    profile of a single request with the "X-Profile: 1" header. Each profile
+    gets a server-generated id and is written to PROFILE_DIR as
+    <profile_id>.folded (sampling mode) or <profile_id>.prof (cProfile mode,
+    readable with pstats/snakeviz) plus a <profile_id>.json summary holding
+    the request id. Only the newest PROFILE_MAX_COUNT profiles are kept.
+    Streaming responses are only profiled until their headers are sent.
+
+    settings['trace_memory'] adds allocation diffs to forced profiles only;
+    tracemalloc is not low-overhead and is off the rest of the time.
+
+    Args:
+        app: Flask app; metrics.init_app must be registered first so requests have ids
+        is_admin: Callable returning whether the current user is an admin
+    """
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint in EXCLUDED_ENDPOINTS:
+            return
+        forced = request.headers.get('X-Profile') == '1' and is_admin()
+        if not forced and random.random() >= settings['sample_rate']:
+            return
+
+        g.profile = {'mode': settings['mode'], 'start': time.perf_counter()}
+        if forced and settings['trace_memory']:
+            g.profile['memory_before'] = _start_tracing()
+
+        if settings['mode'] == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active on this interpreter
+                if 'memory_before' in g.pop('profile'):
+                    _stop_tracing()
+                return
+            g.profile['profiler'] = profiler
+        else:
+            g.profile['thread_id'] = threading.get_ident()
+            sampler.register(g.profile['thread_id'])
+
+    @app.teardown_request
+    def finish_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        elapsed = time.perf_counter() - profile['start']
+        if 'profiler' in profile:
+            profile['profiler'].disable()
+        elif 'thread_id' in profile:
+            stacks = sampler.unregister(profile['thread_id'])
+
+        memory_top = None
+        if 'memory_before' in profile:
+            try:
+                # Allocations are process-wide, so concurrent requests show up here too
+                diff = tracemalloc.take_snapshot().compare_to(profile['memory_before'], 'lineno')
+                memory_top = [
+                    {'location': str(stat.traceback), 'size_diff_kb': round(stat.size_diff / 1024, 1)}
+                    for stat in diff[:20]
+                ]
+            finally:
+                _stop_tracing()
+
+        # Request ids can come from the client (X-Request-ID), so they only
+        # go in the summary and never name files
+        profile_id = _new_profile_id()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base_path = os.path.join(PROFILE_DIR, profile_id)
+
+        if 'profiler' in profile:
+            profile['profiler'].dump_stats(base_path + '.prof')
+        elif 'thread_id' in profile:
+            with open(base_path + '.folded', 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        summary = {
+            'profile_id': profile_id,
+            'request_id': getattr(g, 'request_id', None),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'user': session.get('user'),
+            'mode': profile['mode'],
+            'duration_ms': round(elapsed * 1000, 2),
+            'error': repr(exc) if exc else None,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        if memory_top is not None:
+            summary['memory_top'] = memory_top
+        with open(base_path + '.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        prune_profiles()
+
+
+def list_profiles(limit=100):
+    """Return the summaries of the most recent profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    # Profile ids start with their creation time, so name order is age order
+    names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith('.json')), reverse=True)
+
+    summaries = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                summaries.append(json.load(f))
+        except FileNotFoundError:
+            # Pruned since the listing
+            continue
+    return summaries
@@ -1,39 +1,222 @@
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime
 
+import numpy as np
 
-def compute_recyclability_score(item):
-    material_scores = {
+# Scoring rules used when no versioned rules have been stored yet
+DEFAULT_SCORING_RULES = {
+    "version": 1,
+    "category_scores": {
+        "recycling": 50,
+        "trash": -30,
+    },
+    "material_scores": {
         "plastic": 10,
         "metal": 10,
         "glass": 10,
         "paper": 10,
         "styrofoam": -30,
         "plastic+foil": -20,
-    }
-    
+    },
+    "clean_bonus": 10,
+    "contaminated_penalty": -30,
+    "confidence_weight": 20,  # ±10 adjustment around 0.5 confidence
+}
+
+
+def compute_recyclability_score(item, rules=DEFAULT_SCORING_RULES):
     score = 0
 
     # Base score by category
-    if item.get("category") == "recycling":
-        score += 50
-    elif item.get("category") == "trash":
-        score -= 30
+    score += rules["category_scores"].get(item.get("category"), 0)
 
     # Material score
-    score += material_scores.get(item.get("material", "").lower(), 0)
+    score += rules["material_scores"].get((item.get("material") or "").lower(), 0)
 
     # Cleanliness
     if item.get("clean", False):
-        score += 10
+        score += rules["clean_bonus"]
     if item.get("contaminated", False):
-        score -= 30
+        score += rules["contaminated_penalty"]
 
     # Confidence adjustment
     confidence = item.get("confidence", 1.0)
-    score += int((confidence - 0.5) * 20)  # ±10 adjustment
+    score += int((confidence - 0.5) * rules["confidence_weight"])
 
     return max(0, min(100, score))
-    
 
-def compute_tray_score(items):
-    scores = [compute_recyclability_score(item) for item in items]
+
+def compute_tray_score(items, rules=DEFAULT_SCORING_RULES):
+    scores = [compute_recyclability_score(item, rules) for item in items]
     return round(sum(scores) / len(scores), 2) if scores else 0.0
+
+
+def compute_tray_scores_batch(tray_ids, category, material, clean, contaminated, confidence,
+                              rules=DEFAULT_SCORING_RULES):
+    """
+    Score many items across many trays at once.
+
+    All arguments except rules are equal-length columns with one entry per item.
+    Missing categories/materials may be None, missing confidences NaN or None
+    (treated as 1.0, like compute_recyclability_score).
+
+    Args:
+        tray_ids: Tray (meal) id of each item
+        category: Disposal category of each item
+        material: Material of each item
+        clean: Whether each item is clean
+        contaminated: Whether each item is contaminated
+        confidence: Detection confidence of each item
+        rules: Scoring rules dict, see DEFAULT_SCORING_RULES
+
+    Returns:
+        Tuple of (unique_tray_ids, tray_scores) as NumPy arrays
+    """
+    tray_ids = np.asarray(tray_ids)
+    if tray_ids.size == 0:
+        return tray_ids, np.zeros(0)
+
+    category = np.asarray(category, dtype=object)
+    material = np.char.lower(np.asarray([m or "" for m in material], dtype=str))
+    clean = np.asarray(clean, dtype=bool)
+    contaminated = np.asarray(contaminated, dtype=bool)
+    confidence = np.asarray(confidence, dtype=float)
+    confidence = np.where(np.isnan(confidence), 1.0, confidence)
+
+    # Map categorical columns through the rule tables
+    category_lookup = rules["category_scores"]
+    material_lookup = rules["material_scores"]
+    scores = np.zeros(tray_ids.shape[0])
+    for value, points in category_lookup.items():
+        scores += np.where(category == value, points, 0)
+    for value, points in material_lookup.items():
+        scores += np.where(material == value, points, 0)
+
+    scores += np.where(clean, rules["clean_bonus"], 0)
+    scores += np.where(contaminated, rules["contaminated_penalty"], 0)
+    scores += np.trunc((confidence - 0.5) * rules["confidence_weight"])
+    scores = np.clip(scores, 0, 100)
+
+    # Average per tray
+    unique_ids, inverse = np.unique(tray_ids, return_inverse=True)
+    totals = np.bincount(inverse, weights=scores)
+    counts = np.bincount(inverse)
+    return unique_ids, np.round(totals / counts, 2)
+
+
+def init_scoring_rules(conn):
+    """Create the versioned scoring_rules table and seed it with the default rules."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS scoring_rules (
+        version INTEGER PRIMARY KEY,
+        rules TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    conn.execute(
+        "INSERT OR IGNORE INTO scoring_rules (version, rules, created_at) VALUES (?, ?, ?)",
+        (DEFAULT_SCORING_RULES["version"], json.dumps(DEFAULT_SCORING_RULES), datetime.now().isoformat())
+    )
+    conn.commit()
+
+
+def load_scoring_rules(conn, version=None):
+    """Load a specific version of the scoring rules, or the latest one if version is None."""
+    if version is None:
+        row = conn.execute("SELECT rules FROM scoring_rules ORDER BY version DESC LIMIT 1").fetchone()
+    else:
+        row = conn.execute("SELECT rules FROM scoring_rules WHERE version = ?", (version,)).fetchone()
+
+    if row is None:
+        if version is not None:
+            raise ValueError(f"Unknown scoring rules version: {version}")
+        return DEFAULT_SCORING_RULES
+    return json.loads(row[0])
+
+
+def save_scoring_rules(conn, rules):
+    """Store rules as a new version. Returns the version number assigned."""
+    latest = conn.execute("SELECT MAX(version) FROM scoring_rules").fetchone()[0] or 0
+    rules = dict(rules, version=latest + 1)
+    conn.execute(
+        "INSERT INTO scoring_rules (version, rules, created_at) VALUES (?, ?, ?)",
+        (rules["version"], json.dumps(rules), datetime.now().isoformat())
+    )
+    conn.commit()
+    return rules["version"]
+
+
+def rescore_meals(conn, rules, chunk_size=500):
+    """
+    Recompute tray_score for every scored meal from its meal_items rows.
+
+    Meals are read in id order, chunk_size at a time, so memory use does not
+    grow with the size of the meals table. Meals stored without a tray_score
+    (tray analyses) are left unscored.
+
+    Only the category and confidence rules are re-applied: no route records
+    an item's material or cleanliness, so meal_items has no such columns and
+    those inputs score as neutral, exactly as they did when the meal was
+    first scored. Changing material_scores, clean_bonus or
+    contaminated_penalty therefore doesn't change stored scores.
+
+    Returns:
+        Number of meals re-scored
+    """
+    last_id = 0
+    rescored = 0
+    while True:
+        meal_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM meals WHERE id > ? AND tray_score IS NOT NULL ORDER BY id LIMIT ?",
+            (last_id, chunk_size)
+        )]
+        if not meal_ids:
+            break
+
+        # meal_items has no material/cleanliness columns, so those score as neutral
+        placeholders = ", ".join("?" for _ in meal_ids)
+        rows = conn.execute(
+            f"SELECT meal_id, category, confidence FROM meal_items WHERE meal_id IN ({placeholders})",
+            meal_ids
+        ).fetchall()
+        tray_ids = [row[0] for row in rows]
+        scored_ids, scores = compute_tray_scores_batch(
+            tray_ids,
+            [row[1] for row in rows],
+            [None] * len(rows),
+            [False] * len(rows),
+            [False] * len(rows),
+            [row[2] if row[2] is not None else np.nan for row in rows],
+            rules
+        )
+
+        # Meals without any items keep the empty-tray score
+        new_scores = dict.fromkeys(meal_ids, 0.0)
+        new_scores.update(zip(scored_ids.tolist(), scores.tolist()))
+        conn.executemany(
+            "UPDATE meals SET tray_score = ? WHERE id = ?",
+            [(score, meal_id) for meal_id, score in new_scores.items()]
+        )
+        conn.commit()
+
+        rescored += len(meal_ids)
+        last_id = meal_ids[-1]
+    return rescored
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Re-score stored meals with the current category and confidence scoring rules")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meal_history.db'))
+    parser.add_argument('--version', type=int, help="Scoring rules version (defaults to the latest)")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    init_scoring_rules(conn)
+    rules = load_scoring_rules(conn, args.version)
+    count = rescore_meals(conn, rules, args.chunk_size)
+    conn.close()
+    print(f"Re-scored {count} meals with scoring rules v{rules['version']}")
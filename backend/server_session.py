@@ -0,0 +1,221 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# Where sessions are stored; kept apart from the meal database so session
+# writes don't contend with meal writes
+SESSION_DB_PATH = os.getenv(
+    'SESSION_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db')
+)
+
+# Seconds of inactivity after which a session expires
+SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', 12 * 60 * 60))
+
+# Decoded sessions kept in memory, and how long (seconds) a cached copy is
+# trusted before it is re-read, so changes made by other workers show up
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 1024))
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 30))
+
+# An unchanged session's expiry is only pushed back once this many seconds
+# have passed, so streams and image requests don't each cost a write
+TOUCH_INTERVAL = 60
+
+# Seconds between purges of expired sessions
+PURGE_INTERVAL = 600
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """A session whose data lives on the server; the cookie carries only its id."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id, e.g. after login to prevent session fixation."""
+        self.previous_sid = self.previous_sid or self.sid
+        self.sid = None
+        self.modified = True
+
+
+class SqliteSessionInterface(SessionInterface):
+    """
+    Server-side Flask sessions stored in SQLite with an in-process LRU cache.
+
+    The cookie holds a random session id instead of the signed session data,
+    so requests carry a short header and nothing has to be verified or
+    deserialized per request when the session is cached. Sessions expire
+    after SESSION_IDLE_TIMEOUT seconds without a request.
+
+    Usage:
+        app.session_interface = SqliteSessionInterface()
+    """
+
+    # Same encoding as Flask's cookie sessions, so values like datetimes survive
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, db_path=SESSION_DB_PATH, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 cache_size=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL):
+        self.db_path = db_path
+        self.idle_timeout = idle_timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()   # sid -> (data, expires_at, cached_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+        conn = self._connect()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)')
+        conn.commit()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self._load(sid)
+            if loaded is not None:
+                data, expires_at = loaded
+                session = ServerSession(data, sid=sid)
+                session.expires_at = expires_at
+                return session
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+
+        if session.previous_sid:
+            self._delete(session.previous_sid)
+
+        # Cleared sessions (e.g. logout) are removed along with their cookie
+        if not session:
+            if session.sid:
+                self._delete(session.sid)
+            if session.sid or session.modified:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = secrets.token_urlsafe(32)
+
+        expires_at = now + self.idle_timeout
+        if session.modified or new_sid:
+            self._store(session.sid, dict(session), expires_at)
+        elif expires_at - getattr(session, 'expires_at', 0) > TOUCH_INTERVAL:
+            self._touch(session.sid, expires_at)
+
+        if new_sid:
+            response.vary.add('Cookie')
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+        if now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            self.purge_expired()
+
+    def purge_expired(self):
+        """Delete expired sessions. Returns the number removed."""
+        conn = self._connect()
+        cursor = conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+        conn.commit()
+        return cursor.rowcount
+
+    def stats(self):
+        conn = self._connect()
+        active = conn.execute('SELECT COUNT(*) FROM sessions WHERE expires_at >= ?', (time.time(),)).fetchone()[0]
+        with self._lock:
+            cached = len(self._cache)
+        return {'active_sessions': active, 'cached_sessions': cached}
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=10)
+        return conn
+
+    def _load(self, sid):
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(sid)
+            if cached is not None:
+                data, expires_at, cached_at = cached
+                if expires_at >= now and time.monotonic() - cached_at < self.cache_ttl:
+                    self._cache.move_to_end(sid)
+                    return dict(data), expires_at
+                del self._cache[sid]
+
+        row = self._connect().execute(
+            'SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at >= ?', (sid, now)
+        ).fetchone()
+        if row is None:
+            return None
+        data, expires_at = self.serializer.loads(row[0]), row[1]
+        self._cache_put(sid, data, expires_at)
+        return dict(data), expires_at
+
+    def _store(self, sid, data, expires_at):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)',
+            (sid, self.serializer.dumps(data), expires_at)
+        )
+        conn.commit()
+        self._cache_put(sid, data, expires_at)
+
+    def _touch(self, sid, expires_at):
+        conn = self._connect()
+        conn.execute('UPDATE sessions SET expires_at = ? WHERE id = ?', (expires_at, sid))
+        conn.commit()
+        with self._lock:
+            cached = self._cache.get(sid)
+            if cached is not None:
+                self._cache[sid] = (cached[0], expires_at, cached[2])
+
+    def _delete(self, sid):
+        conn = self._connect()
+        conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+        conn.commit()
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def _cache_put(self, sid, data, expires_at):
+        with self._lock:
+            self._cache[sid] = (data, expires_at, time.monotonic())
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
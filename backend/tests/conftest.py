@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules are imported as top-level modules, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from meal_store import connect_meal_db, init_meal_items, init_meals, insert_meal_items, normalize_items
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Meal database with the meals and meal_items tables."""
+    conn = connect_meal_db(str(tmp_path / 'meals.db'))
+    init_meals(conn)
+    init_meal_items(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def add_meal(conn):
+    """Insert a meal for alice with the given items (labels or item dicts); returns its id."""
+    def add(items, tray_score=None):
+        cursor = conn.execute(
+            "INSERT INTO meals (user_id, meal_date, meal_image, meal_items, tray_score) "
+            "VALUES ('alice', '2024-01-01T12:00:00', '', '[]', ?)",
+            (tray_score,)
+        )
+        insert_meal_items(conn, cursor.lastrowid, normalize_items(items))
+        conn.commit()
+        return cursor.lastrowid
+    return add
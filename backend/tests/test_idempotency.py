@@ -0,0 +1,143 @@
+import threading
+import time
+import types
+
+import pytest
+
+import idempotency
+from idempotency import IdempotencyCache, IdempotencyConflict, IdempotencyTimeout
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(idempotency, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_duplicates_get_the_stored_result(clock):
+    cache = IdempotencyCache()
+
+    assert cache.run('key', lambda: 'first', ttl=10) == ('first', False)
+    assert cache.run('key', lambda: 'second', ttl=10) == ('first', True)
+    assert cache.stats() == {'entries': 1, 'computed': 1, 'replayed': 1, 'waited': 0}
+
+
+def test_waiters_get_the_in_flight_result():
+    cache = IdempotencyCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.run('key', compute, ttl=10)))
+    owner.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.run('key', compute, ttl=10))) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    while cache.stats()['waited'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [owner, *waiters]:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('result', False)] + [('result', True)] * 3
+
+
+def test_failures_are_not_stored_and_reach_waiters():
+    cache = IdempotencyCache()
+    claim = cache.claim('key', ttl=10)
+    waiter = cache.claim('key', ttl=10)
+    assert claim.owner and not waiter.owner
+
+    claim.fail(ValueError('boom'))
+
+    with pytest.raises(ValueError, match='boom'):
+        waiter.wait()
+    assert cache.run('key', lambda: 'retried', ttl=10) == ('retried', False)
+
+
+def test_a_failing_compute_is_retried():
+    cache = IdempotencyCache()
+
+    def fail():
+        raise RuntimeError('down')
+
+    with pytest.raises(RuntimeError):
+        cache.run('key', fail, ttl=10)
+    assert cache.run('key', lambda: 'ok', ttl=10) == ('ok', False)
+
+
+def test_released_claims_do_not_leave_waiters_hanging():
+    cache = IdempotencyCache()
+    claim = cache.claim('key', ttl=10)
+    waiter = cache.claim('key', ttl=10)
+
+    claim.release()
+
+    with pytest.raises(RuntimeError, match='did not complete'):
+        waiter.wait()
+    assert cache.claim('key', ttl=10).owner
+
+
+def test_release_after_complete_keeps_the_result():
+    cache = IdempotencyCache()
+    claim = cache.claim('key', ttl=10)
+    claim.complete('result')
+    claim.release()
+
+    assert cache.run('key', lambda: 'other', ttl=10) == ('result', True)
+
+
+def test_waiting_times_out(monkeypatch):
+    monkeypatch.setattr(idempotency, 'WAIT_TIMEOUT', 0.01)
+    cache = IdempotencyCache()
+    cache.claim('key', ttl=10)
+
+    with pytest.raises(IdempotencyTimeout):
+        cache.run('key', lambda: 'never', ttl=10)
+
+
+def test_results_expire(clock):
+    cache = IdempotencyCache()
+    cache.run('key', lambda: 'old', ttl=10)
+
+    clock.now += 9
+    assert cache.run('key', lambda: 'new', ttl=10) == ('old', True)
+    clock.now += 2
+    assert cache.run('key', lambda: 'new', ttl=10) == ('new', False)
+
+
+def test_oldest_completed_results_are_evicted_past_the_limit(clock):
+    cache = IdempotencyCache(max_entries=2)
+    in_flight = cache.claim('in-flight', ttl=10)
+    cache.run('a', lambda: 'a', ttl=10)
+    cache.run('b', lambda: 'b', ttl=10)
+    cache.run('c', lambda: 'c', ttl=10)
+
+    assert cache.run('a', lambda: 'recomputed', ttl=10) == ('recomputed', False)
+    assert not cache.claim('in-flight', ttl=10).owner
+    in_flight.release()
+
+
+def test_reusing_a_key_for_another_request_conflicts():
+    cache = IdempotencyCache()
+    cache.run('key', lambda: 'result', ttl=10, fingerprint='image-a')
+
+    with pytest.raises(IdempotencyConflict):
+        cache.run('key', lambda: 'result', ttl=10, fingerprint='image-b')
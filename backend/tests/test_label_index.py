@@ -0,0 +1,59 @@
+import pytest
+
+from label_index import LabelIndex, init_label_overrides, save_label_override
+
+
+@pytest.fixture
+def index(conn, tmp_path):
+    init_label_overrides(conn)
+    return LabelIndex(str(tmp_path / 'meals.db'))
+
+
+def tray_item(label, category, detected_category=None):
+    item = {'label': label, 'category': category}
+    if detected_category is not None:
+        item['detected_category'] = detected_category
+    return item
+
+
+@pytest.mark.parametrize('stored, looked_up', [
+    ('glass water bottle', 'plastic water bottle'),
+    ('plastic cup', 'plastic fork'),
+    ('apple', 'apple core'),
+])
+def test_different_items_do_not_match(index, add_meal, stored, looked_up):
+    add_meal([tray_item(stored, 'recycling')])
+    add_meal([tray_item(stored, 'recycling')])
+
+    assert index.lookup(stored)['similarity'] == 1.0
+    assert index.lookup(looked_up) is None
+
+
+def test_plurals_match_fuzzily(index, add_meal):
+    add_meal([tray_item('plastic water bottle', 'recycling')])
+    add_meal([tray_item('plastic water bottle', 'recycling')])
+
+    entry = index.lookup('Plastic Water Bottles')
+    assert entry['label'] == 'plastic water bottle'
+    assert entry['similarity'] < 1.0
+
+
+def test_history_is_learned_from_detected_categories(index, add_meal):
+    # The index had resolved "cup" to trash; Gemini said recycling both times
+    add_meal([tray_item('cup', 'trash', detected_category='recycling')])
+    add_meal([tray_item('cup', 'trash', detected_category='recycling')])
+
+    assert index.lookup('cup')['category'] == 'recycling'
+
+    index.observe([{'label': 'cup', 'category': 'trash', 'detected_category': 'compost', 'is_food': False}] * 3)
+    assert index.lookup('cup')['category'] == 'compost'
+
+
+def test_overrides_win_over_history(conn, index, add_meal):
+    add_meal([tray_item('chip bag', 'recycling')])
+    add_meal([tray_item('chip bag', 'recycling')])
+    save_label_override(conn, 'Chip Bag', category='trash')
+    index.refresh()
+
+    entry = index.lookup('chip bag')
+    assert (entry['category'], entry['source']) == ('trash', 'override')
@@ -0,0 +1,23 @@
+from meal_store import delete_meal, init_meal_items, top_disposed_items
+
+
+def test_deleting_a_meal_deletes_its_items(conn, add_meal):
+    kept = add_meal(['cup'])
+    deleted = add_meal(['cup', 'fork'])
+
+    assert delete_meal(conn, deleted)
+
+    assert conn.execute("SELECT meal_id, label FROM meal_items").fetchall() == [(kept, 'cup')]
+    assert top_disposed_items(conn, '2000-01-01') == [{'label': 'cup', 'category': None, 'count': 1}]
+
+
+def test_init_removes_items_orphaned_before_foreign_keys(conn, add_meal):
+    meal_id = add_meal(['cup'])
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('DELETE FROM meals WHERE id = ?', (meal_id,))
+    conn.commit()
+    conn.execute('PRAGMA foreign_keys = ON')
+
+    init_meal_items(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM meal_items").fetchone()[0] == 0
@@ -0,0 +1,73 @@
+import os
+import tracemalloc
+
+import pytest
+from flask import Flask
+
+import metrics
+import profiling
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def client(profile_dir, monkeypatch):
+    monkeypatch.setitem(profiling.settings, 'sample_rate', 1.0)
+    monkeypatch.setitem(profiling.settings, 'trace_memory', False)
+    app = Flask(__name__)
+    metrics.init_app(app)
+    profiling.init_app(app, lambda: True)
+
+    @app.route('/work')
+    def work():
+        return 'ok'
+
+    return app.test_client()
+
+
+def write_profile(directory, profile_id, size):
+    for ext in ('.folded', '.json'):
+        (directory / (profile_id + ext)).write_bytes(b'x' * size)
+
+
+def test_prune_deletes_oldest_profiles_past_the_count(profile_dir):
+    for second in range(5):
+        write_profile(profile_dir, f"20240101-12000{second}-000-abcd1234", 10)
+
+    assert profiling.prune_profiles(max_count=3) == 2
+
+    assert sorted(os.listdir(profile_dir))[0].startswith('20240101-120002')
+    assert len(os.listdir(profile_dir)) == 6
+
+
+def test_prune_deletes_oldest_profiles_past_the_size(profile_dir):
+    for second in range(4):
+        write_profile(profile_dir, f"20240101-12000{second}-000-abcd1234", 100)
+
+    assert profiling.prune_profiles(max_bytes=450) == 2
+
+
+def test_client_request_ids_do_not_name_profile_files(client, profile_dir):
+    client.get('/work', headers={'X-Request-ID': 'chosen-by-client'})
+    client.get('/work', headers={'X-Request-ID': 'chosen-by-client'})
+
+    summaries = profiling.list_profiles()
+    assert [summary['request_id'] for summary in summaries] == ['chosen-by-client'] * 2
+    assert summaries[0]['profile_id'] != summaries[1]['profile_id']
+    assert not any(name.startswith('chosen-by-client') for name in os.listdir(profile_dir))
+
+
+def test_memory_is_traced_only_during_forced_requests(client, monkeypatch):
+    monkeypatch.setitem(profiling.settings, 'trace_memory', True)
+
+    client.get('/work', headers={'X-Request-ID': 'sampled'})
+    client.get('/work', headers={'X-Request-ID': 'forced', 'X-Profile': '1'})
+
+    summaries = {summary['request_id']: summary for summary in profiling.list_profiles()}
+    assert 'memory_top' not in summaries['sampled']
+    assert 'memory_top' in summaries['forced']
+    assert not tracemalloc.is_tracing()
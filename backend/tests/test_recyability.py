@@ -0,0 +1,37 @@
+import copy
+
+from recyability import DEFAULT_SCORING_RULES, compute_tray_score, rescore_meals
+
+
+def tray_score(conn, meal_id):
+    return conn.execute("SELECT tray_score FROM meals WHERE id = ?", (meal_id,)).fetchone()[0]
+
+
+def test_rescore_skips_meals_stored_without_a_score(conn, add_meal):
+    items = [{'label': 'can', 'category': 'recycling', 'confidence': 0.9}]
+    scored = add_meal(items, compute_tray_score(items))
+    unscored = add_meal(items, None)
+    rules = copy.deepcopy(DEFAULT_SCORING_RULES)
+    rules['category_scores']['recycling'] = 80
+
+    assert rescore_meals(conn, rules, chunk_size=1) == 1
+
+    assert tray_score(conn, scored) == compute_tray_score(items, rules)
+    assert tray_score(conn, unscored) is None
+
+
+def test_rescore_reapplies_category_rules_but_not_material_rules(conn, add_meal):
+    items = [{'label': 'bottle', 'category': 'recycling', 'confidence': 0.5}]
+    meal_id = add_meal(items, compute_tray_score(items))
+    original = tray_score(conn, meal_id)
+
+    # Materials aren't recorded for stored items, so material rules can't change their score
+    material_rules = copy.deepcopy(DEFAULT_SCORING_RULES)
+    material_rules['material_scores']['plastic'] = 40
+    rescore_meals(conn, material_rules)
+    assert tray_score(conn, meal_id) == original
+
+    category_rules = copy.deepcopy(DEFAULT_SCORING_RULES)
+    category_rules['category_scores']['recycling'] = 70
+    rescore_meals(conn, category_rules)
+    assert tray_score(conn, meal_id) == 70
@@ -0,0 +1,197 @@
+import argparse
+import base64
+import io
+import os
+import queue
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_ingest import REDUCED_JPEG_FLAGS, resize_to_fit
+from meal_store import connect_meal_db
+
+# Longest side of the meal history thumbnails; history cards are at least
+# 300px wide, so this stays sharp without approaching the archive size
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 384))
+
+# "webp" or "jpeg"
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'webp')
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+
+ENCODINGS = {
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY),
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+}
+
+
+def init_meal_thumbnails(conn):
+    """Create the meal_thumbnails table."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS meal_thumbnails (
+        meal_id INTEGER PRIMARY KEY REFERENCES meals(id) ON DELETE CASCADE,
+        image BLOB NOT NULL,
+        mime_type TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        height INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+def render_thumbnail(image_data, size=THUMBNAIL_SIZE, fmt=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY):
+    """
+    Downscale an encoded meal image.
+
+    JPEGs are decoded at a reduced scale when they are at least twice as
+    large as needed, as in image_ingest.read_image.
+
+    Args:
+        image_data: Encoded image bytes (the decoded meals.meal_image)
+        size: Longest side of the thumbnail in pixels
+        fmt: "webp" or "jpeg"
+        quality: Encoder quality (0-100)
+
+    Returns:
+        Tuple of (encoded bytes, MIME type, width, height)
+
+    Raises:
+        ValueError: If the image cannot be decoded or the format is unknown
+    """
+    if fmt not in ENCODINGS:
+        raise ValueError(f"Unknown thumbnail format '{fmt}'")
+    ext, mime_type, quality_flag = ENCODINGS[fmt]
+
+    try:
+        # Only reads the header
+        with Image.open(io.BytesIO(image_data)) as img:
+            original_longest = max(img.size)
+            is_jpeg = img.format == 'JPEG'
+    except OSError:
+        raise ValueError('Meal image could not be decoded')
+
+    flag = cv2.IMREAD_COLOR
+    if is_jpeg:
+        for factor, reduced_flag in REDUCED_JPEG_FLAGS:
+            if original_longest / factor >= size:
+                flag = reduced_flag
+                break
+
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), flag)
+    if image is None:
+        raise ValueError('Meal image could not be decoded')
+
+    image, _ = resize_to_fit(image, size)
+    ok, encoded = cv2.imencode(ext, image, [quality_flag, quality])
+    if not ok:
+        raise ValueError(f"Could not encode thumbnail as {fmt}")
+    height, width = image.shape[:2]
+    return encoded.tobytes(), mime_type, width, height
+
+
+def save_thumbnail(conn, meal_id, img_base64):
+    """Render and store the thumbnail for one meal."""
+    data, mime_type, width, height = render_thumbnail(base64.b64decode(img_base64))
+    conn.execute(
+        "INSERT OR REPLACE INTO meal_thumbnails (meal_id, image, mime_type, width, height, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (meal_id, data, mime_type, width, height, datetime.now().isoformat())
+    )
+    conn.commit()
+
+
+def get_thumbnail(conn, meal_id, user_id):
+    """
+    Return (image bytes, MIME type) of a meal's thumbnail, or None if the meal
+    has no thumbnail yet or doesn't belong to user_id.
+    """
+    return conn.execute('''
+    SELECT t.image, t.mime_type FROM meal_thumbnails t
+    JOIN meals m ON m.id = t.meal_id
+    WHERE t.meal_id = ? AND m.user_id = ?
+    ''', (meal_id, user_id)).fetchone()
+
+
+def backfill_thumbnails(conn, chunk_size=100):
+    """
+    Generate thumbnails for every meal that doesn't have one.
+
+    Meals are read in id order, chunk_size at a time, so memory use does not
+    grow with the size of the meals table. Meals whose image can't be decoded
+    are reported and skipped.
+
+    Returns:
+        Number of thumbnails generated
+    """
+    last_id = 0
+    generated = 0
+    while True:
+        rows = conn.execute('''
+        SELECT id, meal_image FROM meals
+        WHERE id > ? AND NOT EXISTS (SELECT 1 FROM meal_thumbnails WHERE meal_id = meals.id)
+        ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        for meal_id, img_base64 in rows:
+            try:
+                save_thumbnail(conn, meal_id, img_base64)
+                generated += 1
+            except (ValueError, TypeError) as e:
+                print(f"Skipping meal {meal_id}: {e}")
+        last_id = rows[-1][0]
+    return generated
+
+
+class ThumbnailWorker:
+    """
+    Renders meal thumbnails on a background thread so saving a meal doesn't
+    wait for the extra encode.
+
+    Usage:
+        worker = ThumbnailWorker(DB_PATH)
+        worker.submit(meal_id, img_base64)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, meal_id, img_base64):
+        self._ensure_running()
+        self._queue.put((meal_id, img_base64))
+
+    def _ensure_running(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='thumbnail-worker', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = connect_meal_db(self.db_path, timeout=10)
+        while True:
+            meal_id, img_base64 = self._queue.get()
+            try:
+                save_thumbnail(conn, meal_id, img_base64)
+            except Exception as e:
+                print(f"Thumbnail for meal {meal_id} failed: {e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate meal history thumbnails for meals that don't have one")
+    parser.add_argument('--db', default=os.getenv(
+        'MEAL_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meal_history.db')
+    ))
+    parser.add_argument('--chunk-size', type=int, default=100)
+    args = parser.parse_args()
+
+    conn = connect_meal_db(args.db)
+    init_meal_thumbnails(conn)
+    count = backfill_thumbnails(conn, args.chunk_size)
+    conn.close()
+    print(f"Generated {count} thumbnails ({THUMBNAIL_FORMAT}, {THUMBNAIL_SIZE}px)")
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from image_upload import CHUNK_SIZE, sniff_image_type
+
+# Where uploads are spooled before processing
+UPLOAD_SPOOL_DIR = os.getenv(
+    'UPLOAD_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+)
+
+# Total size (bytes) and age (seconds) the spool may reach before the sweeper
+# evicts the least recently used uploads
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', 512 * 1024 * 1024))
+SPOOL_MAX_AGE = float(os.getenv('SPOOL_MAX_AGE', 24 * 60 * 60))
+
+# Seconds between sweeps
+SPOOL_SWEEP_INTERVAL = float(os.getenv('SPOOL_SWEEP_INTERVAL', 60))
+
+# Uploads used more recently than this are never evicted, so a file isn't
+# deleted while a request is still reading it
+MIN_RESIDENCY = 300
+
+# Partial writes left behind by a crashed worker are removed after this many seconds
+TEMP_FILE_MAX_AGE = 3600
+
+TEMP_PREFIX = '.spool-'
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/bmp': '.bmp',
+    'image/webp': '.webp',
+}
+
+
+class UploadSpool:
+    """
+    Content-addressed store for uploaded images.
+
+    Each upload is written to a temporary file and renamed to the SHA-256 of
+    its contents, so concurrent uploads never overwrite each other, readers
+    never see a partial file, and identical uploads share one file. A
+    background sweeper deletes uploads older than max_age and then the least
+    recently used ones until the spool fits in max_bytes. Storing an upload
+    that already exists refreshes its modification time, which is what the
+    sweeper orders by, so the spool works across processes.
+
+    Usage:
+        spool = UploadSpool()
+        path = spool.put(image_bytes)
+        path = spool.put_stream(request.files['file'].stream)
+    """
+
+    def __init__(self, directory=UPLOAD_SPOOL_DIR, max_bytes=SPOOL_MAX_BYTES, max_age=SPOOL_MAX_AGE,
+                 sweep_interval=SPOOL_SWEEP_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._files = 0
+        self._bytes = 0
+        self.stores = 0
+        self.dedup_hits = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.last_sweep = None
+
+    def put(self, data):
+        """
+        Store image bytes.
+
+        Returns:
+            Path of the stored upload
+
+        Raises:
+            ValueError: If the data is not a supported image
+        """
+        ext = self._extension(data[:12])
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, digest + ext)
+        if self._reuse(path):
+            return path
+
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        self._commit(temp_path, path, len(data))
+        return path
+
+    def put_stream(self, stream):
+        """
+        Store an image from a binary stream, hashing it as it is copied.
+
+        Returns:
+            Path of the stored upload
+
+        Raises:
+            ValueError: If the data is not a supported image
+        """
+        header = stream.read(12)
+        ext = self._extension(header)
+
+        hasher = hashlib.sha256(header)
+        size = len(header)
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        path = os.path.join(self.directory, hasher.hexdigest() + ext)
+        if self._reuse(path):
+            os.unlink(temp_path)
+            return path
+        self._commit(temp_path, path, size)
+        return path
+
+    def sweep(self):
+        """
+        Evict expired and least recently used uploads.
+
+        Returns:
+            Number of uploads evicted
+        """
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith(TEMP_PREFIX):
+                if now - stat.st_mtime > TEMP_FILE_MAX_AGE:
+                    self._remove(entry.path)
+                continue
+            if os.path.splitext(entry.name)[1] in EXTENSIONS.values():
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # Oldest first; anything past max_age goes, then more until under max_bytes
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        evicted = evicted_bytes = 0
+        kept = []
+        for mtime, size, path in entries:
+            age = now - mtime
+            if age > MIN_RESIDENCY and (age > self.max_age or total > self.max_bytes):
+                if self._remove(path):
+                    total -= size
+                    evicted += 1
+                    evicted_bytes += size
+                    continue
+            kept.append(size)
+
+        with self._lock:
+            self._files = len(kept)
+            self._bytes = sum(kept)
+            self.evictions += evicted
+            self.evicted_bytes += evicted_bytes
+            self.last_sweep = now
+        return evicted
+
+    def start(self):
+        """Start the background sweeper (idempotent)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='upload-spool-sweeper', daemon=True)
+                self._thread.start()
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'files': self._files,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'stores': self.stores,
+                'dedup_hits': self.dedup_hits,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'last_sweep': self.last_sweep,
+            }
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"Upload spool sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def _extension(self, header):
+        mime_type = sniff_image_type(header)
+        if mime_type is None:
+            raise ValueError('Uploaded data is not a supported image')
+        return EXTENSIONS[mime_type]
+
+    def _reuse(self, path):
+        # Refreshing the mtime marks the upload as recently used for the sweeper
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self.dedup_hits += 1
+        return True
+
+    def _commit(self, temp_path, path, size):
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.stores += 1
+            self._files += 1
+            self._bytes += size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False